@@ -1,18 +1,229 @@
-from sqlalchemy import create_engine
+import os
+import time
+
+from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
+from backend.utils.cache import TTLCache
+from backend.utils.metrics import observe_pool_wait
+
+load_dotenv()
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
+# Replica serving GET routes, by default the primary database itself through its own pool
+READ_DATABASE_URL = os.getenv("READ_DATABASE_URL", SQLALCHEMY_DATABASE_URL)
+# Async driver for each database the sync URL may point at
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+# Connection pool, ignored by in-memory SQLite which keeps a single connection
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+
+# The read pool is sized separately, each setting falls back to its DB_ counterpart
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", DB_POOL_SIZE))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", DB_MAX_OVERFLOW))
+DB_READ_POOL_TIMEOUT = float(os.getenv("DB_READ_POOL_TIMEOUT", DB_POOL_TIMEOUT))
+DB_READ_POOL_RECYCLE = int(os.getenv("DB_READ_POOL_RECYCLE", DB_POOL_RECYCLE))
+DB_READ_POOL_PRE_PING = os.getenv("DB_READ_POOL_PRE_PING", str(DB_POOL_PRE_PING)).lower() in ("1", "true", "yes")
+
+# After a write, reads of the same client go to the primary for this long so they see their own changes
+# even when the replica lags behind
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+READ_YOUR_WRITES_MAX_CLIENTS = int(os.getenv("READ_YOUR_WRITES_MAX_CLIENTS", 10000))
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Applied to every new SQLite connection. WAL lets readers run while a write is in progress and
+# synchronous=NORMAL is safe with WAL (a power loss may drop the last commits, never corrupt the file).
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", 64 * 1024))
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and (url.rstrip("/").endswith(":memory:") or url.rstrip("/") in ("sqlite:", "sqlite:/"))
+
+
+def sqlite_pragmas(read_only: bool = False) -> dict:
+    pragmas = {
+        "journal_mode": SQLITE_JOURNAL_MODE,
+        "synchronous": SQLITE_SYNCHRONOUS,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": SQLITE_MMAP_SIZE,
+        # A negative cache_size is in KiB instead of pages
+        "cache_size": -SQLITE_CACHE_SIZE_KB,
+    }
+    if read_only:
+        # Last, journal_mode may still have to convert a fresh copy to WAL
+        pragmas["query_only"] = "ON"
+    return pragmas
+
+
+def pool_settings(read: bool = False) -> dict:
+    if read:
+        return dict(pool_size=DB_READ_POOL_SIZE, max_overflow=DB_READ_MAX_OVERFLOW, pool_timeout=DB_READ_POOL_TIMEOUT,
+                    pool_recycle=DB_READ_POOL_RECYCLE, pool_pre_ping=DB_READ_POOL_PRE_PING)
+    return dict(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT,
+                pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=DB_POOL_PRE_PING)
+
+
+def async_database_url(url: str) -> str:
+    """The same database as `url`, through its async driver. ASYNC_DATABASE_URL overrides it."""
+    if os.getenv("ASYNC_DATABASE_URL"):
+        return os.getenv("ASYNC_DATABASE_URL")
+    scheme, rest = url.split("://", 1)
+    backend = scheme.split("+")[0]
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver known for {scheme}, set ASYNC_DATABASE_URL")
+    return f"{ASYNC_DRIVERS[backend]}://{rest}"
+
+
+class TimedPool:
+    # Reports how long each checkout took, waiting for a free connection included, under the pool's logging name
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            observe_pool_wait(self.logging_name, time.perf_counter() - started)
+
+
+class TimedQueuePool(TimedPool, QueuePool):
+    pass
+
+
+# Also for aiosqlite, which would otherwise open a new connection (and set the pragmas again) for every session
+class TimedAsyncAdaptedQueuePool(TimedPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def build_engine(url: str, name: str, create=create_engine, read_only: bool = False):
+    """
+    Engine for `url` with the write pool settings, or the read ones and query_only SQLite connections. `name`
+    labels its pool in the logs and metrics.
+    """
+    options = {}
+    if not _is_memory_sqlite(url):
+        options.update(pool_settings(read_only))
+        options["poolclass"] = TimedAsyncAdaptedQueuePool if create is create_async_engine else TimedQueuePool
+        options["pool_logging_name"] = name
+    if not _is_sqlite(url):
+        return create(url, **options)
+
+    new_engine = create(
+        url, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}, **options
+    )
+
+    # Async engines emit connection events on their sync core
+    @event.listens_for(getattr(new_engine, "sync_engine", new_engine), "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in sqlite_pragmas(read_only).items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
+    return new_engine
+
+
+def engine_settings(bind, read_only: bool = False) -> str:
+    """One line describing the effective database settings, for the startup log."""
+    settings = [f"url={bind.url.render_as_string(hide_password=True)}", f"pool={type(bind.pool).__name__}"]
+    if not _is_memory_sqlite(str(bind.url)):
+        pool = pool_settings(read_only)
+        settings.append(
+            f"pool_size={pool['pool_size']} max_overflow={pool['max_overflow']} pool_timeout={pool['pool_timeout']}s "
+            f"pool_recycle={pool['pool_recycle']}s pre_ping={pool['pool_pre_ping']}"
+        )
+    # The async engines share the connect listener, their pragmas are the same as the sync ones'
+    if bind.dialect.name == "sqlite" and not isinstance(bind, AsyncEngine):
+        # Read back from the database, journal_mode may silently stay as it was (e.g. for in-memory databases)
+        with bind.connect() as connection:
+            effective = {
+                name: connection.exec_driver_sql(f"PRAGMA {name}").scalar() for name in sqlite_pragmas(read_only)
+            }
+        settings.append(" ".join(f"{name}={value}" for name, value in effective.items()))
+    return ", ".join(settings)
+
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL, "write")
+read_engine = build_engine(READ_DATABASE_URL, "read", read_only=True)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Used by the async read routes, which then never hold a threadpool slot while waiting on the database.
+# The primary one only serves the reads of clients inside their read-your-writes window.
+async_engine = build_engine(async_database_url(SQLALCHEMY_DATABASE_URL), "async_write", create=create_async_engine)
+async_read_engine = build_engine(
+    async_database_url(READ_DATABASE_URL), "async_read", create=create_async_engine, read_only=True
+)
+
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(async_read_engine, autoflush=False, expire_on_commit=False)
+
+# Every engine of the app, write and read, sync and async, by the name used in the metrics
+engines = (engine, read_engine, async_engine, async_read_engine)
+engine_names = ("write", "read", "async_write", "async_read")
+
+# Writer key -> True, for as long as the client's reads have to see the primary
+recent_writers = TTLCache(max_entries=READ_YOUR_WRITES_MAX_CLIENTS, ttl=READ_YOUR_WRITES_SECONDS)
 
 Base = declarative_base()
 
+
+def _writer_key(request: Request):
+    # The bearer token identifies the client, anonymous requests (e.g. the cart) fall back to the address
+    authorization = request.headers.get("authorization")
+    if authorization:
+        return "auth", authorization
+    return "address", request.client.host if request.client else None
+
+
+def note_write(request: Request):
+    """Send the reads of the client behind `request` to the primary for READ_YOUR_WRITES_SECONDS."""
+    if request.method not in SAFE_METHODS:
+        recent_writers.set(_writer_key(request), True)
+
+
+def reads_from_primary(request: Request) -> bool:
+    return recent_writers.get(_writer_key(request), False)
+
+
+def read_bind(request: Request):
+    """The sync engine reads of `request` should use, for code that opens its own connection."""
+    return engine if reads_from_primary(request) else read_engine
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+def get_read_db(request: Request):
+    # For GET routes, from the read pool unless the client has just written
+    db = SessionLocal() if reads_from_primary(request) else ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db(request: Request):
+    session_factory = AsyncSessionLocal if reads_from_primary(request) else AsyncReadSessionLocal
+    async with session_factory() as db:
+        yield db
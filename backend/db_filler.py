@@ -1,7 +1,6 @@
 import random
 import string
 from datetime import datetime
-import bcrypt
 from backend.logging_config import logger
 from sqlalchemy.orm import Session
 from backend.models import Client, Order_product, Port, Operation, Product, Ship, UserRole
@@ -10,7 +9,8 @@ from backend.models.operation import OperationType
 from backend.models.order import Order, OrderStatus
 from backend.database import get_db
 import os
-import base64
+from backend.utils.blob_store import save_blob
+from backend.utils.password_hashing import hash_password_sync
 
 cities = [
     'New York', 'Los Angeles', 'Chicago', 'Houston', 'Phoenix',
@@ -88,25 +88,27 @@ def generate_clients(db:Session, num_to_generate: int):
     '.com', '.pl', '.org', '.net', '.edu',
     '.gov', '.co', '.info', '.io', '.us']
     
+    taken = set()  # logon_name and email are unique, users added in this batch are not flushed yet
     for _ in range(num_to_generate):
         part1, part2 = random.sample(username_parts, 2)
         digits = random.randint(0, 99)
         logon_name = part1 + part2 + str(digits)
+        email = part1 + part2 + "@" + random.choice(email_domains) + random.choice(domain_extensions)
 
-        existing_user = db.query(Client).filter(Client.logon_name == logon_name).first()
+        existing_user = db.query(Client).filter((Client.logon_name == logon_name) | (Client.email == email)).first()
 
-        if not existing_user:
+        if not existing_user and logon_name not in taken and email not in taken:
+            taken.update((logon_name, email))
             password = ''.join(random.choice(string.ascii_letters + string.digits
                                                   ) for _ in range(random.randint(8, 15)))
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            hashed_password = hash_password_sync(password)
             new_user = Client(
                 name = random.choice(first_names),
                 address = random.choice(cities) + " " + random.choice(streets) + 
                 " " + str(random.randint(1, 99)) + " " + str(random.randint(10, 99)) + 
                 "-" + str(random.randint(100, 999)),
                 telephone_number=str(random.randint(100000000, 999999999)),
-                email = part1 + part2 + "@" + random.choice(email_domains) +
-                random.choice(domain_extensions),
+                email = email,
                 logon_name=logon_name,
                 password=hashed_password,
                 role=UserRole.CLIENT if random.random() < 0.6 else UserRole.EMPLOYEE
@@ -173,7 +175,7 @@ def generate_products(db: Session, num_to_generate: int):
         image_path = f"backend/uploads/default_products/{name}.jpg"
         try:
             with open(image_path, "rb") as image_file:
-                image = base64.b64encode(image_file.read()).decode('utf-8')
+                image = save_blob(image_file.read())
         except Exception as e:
             logger.error(f"Error encoding image {image_path}: {e}")
 
@@ -219,7 +221,7 @@ def generate_ships(db: Session, num_to_generate: int):
                 selected_image = random.choice(image_files)
                 image_path = os.path.join(folder_path, selected_image)
                 with open(image_path, "rb") as image_file:
-                    image = base64.b64encode(image_file.read()).decode('utf-8')
+                    image = save_blob(image_file.read())
             else:
                 logger.error("Brak obrazków w folderze.")
             
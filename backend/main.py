@@ -1,20 +1,32 @@
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import HTMLResponse, Response
 from pathlib import Path
-from backend.database import engine, Base
+from backend.database import async_engine, async_read_engine, engine, read_engine, Base, engine_settings, note_write
+from backend.database import engine_names, engines
 
-from backend.routes import ship, operation, port, product, order, client, order_product, cart
+from backend.routes import ship, operation, port, product, order, client, order_product, cart, export
 from backend.models import Client, UserRole
 from backend.db_filler import db_filler
+from backend.migrations import run_migrations
 from backend.logging_config import logger
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from backend.database import get_db
-import bcrypt
-from backend.utils.update_block_list import update_blocklist
+from backend.utils.password_hashing import hash_password_sync, shutdown_pool
+from backend.utils.update_block_list import BLOCKLIST_REFRESH_INTERVAL_SECONDS, refresh_blocklist_periodically
+import asyncio
+from backend.utils.domain_blocklist import domain_blocklist
+from backend.utils.pagination import NEXT_CURSOR_HEADER
+from backend.utils.response_cache import catalog_cache
+from backend.utils.role_validation import check_user_role
+from backend.routes.client import get_current_client
+from backend.utils.metrics import MetricsMiddleware, instrument_engine, register_table_row_counts, registry
+from backend.utils.query_tracking import track_engine, track_queries
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 #Base.metadata.drop_all(bind=engine)  ## <- to drop tables
 Base.metadata.create_all(bind=engine)   # to create them
+run_migrations(engine)
 
 app = FastAPI()
 
@@ -24,8 +36,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag", "Server-Timing"],
 )
 
+@app.middleware("http")
+async def remember_writers(request: Request, call_next):
+    response = await call_next(request)
+    # Recorded once the write is committed, the client's next reads go to the primary; a rejected write
+    # (failed login, validation error, 409) changed nothing and does not pin the client
+    if response.status_code < 400:
+        note_write(request)
+    return response
+
+# Added last so it is the outermost middleware and times everything else
+app.add_middleware(MetricsMiddleware)
+for bind, name in zip(engines, engine_names):
+    instrument_engine(bind, name)
+    track_engine(bind)
+register_table_row_counts(read_engine, Base.metadata.sorted_tables)
+
+
 # Database routers
 app.include_router(ship.router, prefix='/api')
 app.include_router(operation.router, prefix='/api')
@@ -35,16 +65,24 @@ app.include_router(client.router, prefix='/api')
 app.include_router(order.router, prefix='/api')
 app.include_router(order_product.router, prefix='/api')
 app.include_router(cart.router, prefix='/api')
+app.include_router(export.router, prefix='/api')
 
 
 
 @app.on_event('startup')
 async def startup_event():
-    #update_blocklist()  # Fetch and update the blocklist
-    #print("Email blocklist updated")
     logger.info("Server started")
+    logger.info(f"Database: {engine_settings(engine)}")
+    logger.info(f"Read database: {engine_settings(read_engine, read_only=True)}")
+    logger.info(f"Async database: {engine_settings(async_engine)}")
+    logger.info(f"Async read database: {engine_settings(async_read_engine, read_only=True)}")
+    domain_blocklist.load_from_db()
+    if BLOCKLIST_REFRESH_INTERVAL_SECONDS > 0:
+        # Runs in the background so a slow or unreachable blocklist source never delays startup
+        app.state.blocklist_refresh = asyncio.create_task(refresh_blocklist_periodically())
     create_default_users()
-    db_filler()
+    with track_queries("db_filler"):
+        db_filler()
 
 def create_user_if_not_exists(db: Session, logon_name: str, name: str, address: str, telephone_number: int, email: str, password: str, role: UserRole):
     existing_user = db.query(Client).filter(Client.logon_name == logon_name).first()
@@ -53,7 +91,7 @@ def create_user_if_not_exists(db: Session, logon_name: str, name: str, address:
         logger.info(f"User with logon_name '{logon_name}' already exists. Skipping creation of the user")
         return
 
-    hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_password = hash_password_sync(password)
     new_user = Client(
         name=name,
         address=address,
@@ -111,6 +149,11 @@ def create_default_users():
 
 @app.on_event('shutdown')
 async def shutdown_event():
+    if getattr(app.state, "blocklist_refresh", None):
+        app.state.blocklist_refresh.cancel()
+    shutdown_pool()
+    await async_engine.dispose()
+    await async_read_engine.dispose()
     logger.info("Server stopped")
 
 @app.get('/', response_class=HTMLResponse)
@@ -123,3 +166,13 @@ async def health_check():
     logger.info("Health checking")
     return {"message": "API is running"}
 
+@app.get('/metrics', include_in_schema=False)
+def metrics():
+    # Prometheus text format; sync so the row counts are not taken on the event loop
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get('/api/catalog_cache/stats', response_model=dict)
+def get_catalog_cache_stats(current_client=Depends(get_current_client)):
+    check_user_role(current_client, [UserRole.ADMIN])
+    return catalog_cache.stats()
+
@@ -0,0 +1,139 @@
+import base64
+import binascii
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, DateTime, func, inspect, text, update
+from sqlalchemy.orm import Session
+
+from backend.database import Base
+from backend.logging_config import logger
+from backend.models import Client, Product, Ship
+from backend.utils.blob_store import save_blob
+
+# create_all only creates missing tables, every change to data or to an existing table goes through here.
+# Migrations run in version order on startup and each one is recorded in schema_version once applied. A
+# migration that returns False could not be applied yet: it is rolled back, not recorded and retried next startup.
+MIGRATIONS = []
+BATCH_SIZE = 100
+
+
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    version = Column(Integer, primary_key=True)
+    description = Column(String(255), nullable=False)
+    applied_at = Column(DateTime, default=datetime.now, nullable=False)
+
+
+def migration(version: int, description: str):
+    def register(apply):
+        MIGRATIONS.append((version, description, apply))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return apply
+    return register
+
+
+def run_migrations(engine):
+    SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+    with Session(engine) as session:
+        applied = {row.version for row in session.query(SchemaVersion.version).all()}
+        for version, description, apply in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info(f"Applying migration {version}: {description}")
+            if apply(session) is False:
+                session.rollback()
+                logger.warning(f"Migration {version} not applied, it will be retried on the next startup")
+                continue
+            session.add(SchemaVersion(version=version, description=description))
+            session.commit()
+
+
+def _move_images_to_blob_store(session: Session, model, pk_column):
+    # Keyset batches keep at most BATCH_SIZE decoded images in memory at a time
+    last_id = 0
+    moved = 0
+    while True:
+        rows = (
+            session.query(pk_column, model.image)
+            .filter(pk_column > last_id, func.length(model.image) > 64)
+            .order_by(pk_column)
+            .limit(BATCH_SIZE)
+            .all()
+        )
+        if not rows:
+            break
+        values = []
+        for id_, image in rows:
+            try:
+                values.append({pk_column.key: id_, "image": save_blob(base64.b64decode(image))})
+            except (binascii.Error, ValueError) as e:
+                # Left as is, the image routes already treat a value that is not a digest as missing
+                logger.error(f"Not moving {model.__tablename__} {id_} image to the blob store, not valid base64: {e}")
+        if values:
+            session.execute(update(model), values)
+        session.commit()
+        moved += len(values)
+        last_id = rows[-1][0]
+    logger.info(f"Moved {moved} {model.__tablename__} images to the blob store")
+
+
+@migration(1, "Move inline base64 product and ship images to the blob store")
+def move_images_to_blob_store(session: Session):
+    _move_images_to_blob_store(session, Product, Product.id_product)
+    _move_images_to_blob_store(session, Ship, Ship.id_ship)
+
+
+def _create_index(session: Session, name: str, table: str, *columns: str, unique: bool = False):
+    quote = session.get_bind().dialect.identifier_preparer.quote
+    session.execute(text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {quote(table)} "
+        f"({', '.join(quote(column) for column in columns)})"
+    ))
+
+
+def _duplicated_values(session: Session, column) -> list:
+    return [value for value, _ in session.query(column, func.count()).group_by(column).having(func.count() > 1)]
+
+
+@migration(2, "Index foreign key and lookup columns")
+def add_lookup_indexes(session: Session):
+    # Names match what create_all generates for index=True, so fresh and migrated databases end up identical
+    _create_index(session, "ix_operation_id_port", "operation", "id_port")
+    _create_index(session, "ix_operation_id_ship", "operation", "id_ship")
+    _create_index(session, "ix_operation_id_order", "operation", "id_order")
+    _create_index(session, "ix_order_id_port", "order", "id_port")
+    _create_index(session, "ix_order_id_client", "order", "id_client")
+    _create_index(session, "ix_order_products_id_product", "order_products", "id_product")
+    _create_index(session, "ix_product_id_port", "product", "id_port")
+
+
+@migration(3, "Index operations of a port by date")
+def add_port_operation_date_index(session: Session):
+    # Serves the keyset pages and date range filter of /ports/{id}/operations
+    _create_index(session, "ix_operation_port_date", "operation", "id_port", "date_of_operation")
+
+
+@migration(4, "Add version columns to orders and cart lines")
+def add_version_columns(session: Session):
+    # Existing rows start at version 1, fresh databases already get the column from create_all
+    quote = session.get_bind().dialect.identifier_preparer.quote
+    inspector = inspect(session.connection())
+    for table in ("order", "order_products"):
+        if "version" in {column["name"] for column in inspector.get_columns(table)}:
+            continue
+        session.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN version INTEGER NOT NULL DEFAULT 1"))
+
+
+@migration(5, "Make client logon_name and email unique")
+def add_unique_client_indexes(session: Session):
+    # Older databases may hold duplicates (db_filler never checked emails). The server still starts without the
+    # indexes, and once those clients get distinct values the next startup adds them.
+    indexes = (("ix_client_logon_name", Client.logon_name), ("ix_client_email", Client.email))
+    duplicated = {column.key: _duplicated_values(session, column) for _, column in indexes}
+    if any(duplicated.values()):
+        for key, values in duplicated.items():
+            if values:
+                logger.error(f"Not making client.{key} unique yet, duplicated values: {values}")
+        return False
+    for name, column in indexes:
+        _create_index(session, name, "client", column.key, unique=True)
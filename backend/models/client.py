@@ -16,8 +16,8 @@ class Client(Base):
     name = Column(String(255),nullable=False)
     address = Column(String(255),nullable=False)
     telephone_number = Column(Integer)
-    email = Column(String(255),nullable=False)
-    logon_name = Column(String(255),nullable=False)
+    email = Column(String(255),nullable=False, unique=True, index=True)
+    logon_name = Column(String(255),nullable=False, unique=True, index=True)
     password = Column(String(255),nullable=False)
     role = Column(Enum(UserRole), default=UserRole.CLIENT)
 
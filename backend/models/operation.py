@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, DateTime, Enum, String, ForeignKey
+from sqlalchemy import Column, Integer, DateTime, Enum, String, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -35,13 +35,17 @@ class Operation(Base):
     name_of_operation = Column(String(255),nullable=False)
     operation_type = Column(Enum(OperationType), default=OperationType.AT_BAY)
     date_of_operation = Column(DateTime, default=datetime.now(), nullable=False)
-    id_ship = Column(Integer, ForeignKey('ship.id_ship'), nullable=False)
-    id_port = Column(Integer, ForeignKey('port.id_port'), nullable=False)
-    id_order = Column(Integer, ForeignKey('order.id_order'), nullable=False)
+    id_ship = Column(Integer, ForeignKey('ship.id_ship'), nullable=False, index=True)
+    id_port = Column(Integer, ForeignKey('port.id_port'), nullable=False, index=True)
+    id_order = Column(Integer, ForeignKey('order.id_order'), nullable=False, index=True)
 
     ship = relationship("Ship", back_populates="operations")
     port = relationship("Port", back_populates="operations")
     order = relationship("Order", back_populates="operations")
 
+    __table_args__ = (
+        Index("ix_operation_port_date", "id_port", "date_of_operation"),
+    )
+
 
 
@@ -1,5 +1,5 @@
 from sqlalchemy import Column, Integer, DateTime, Enum, ForeignKey, String
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import query_expression, relationship
 from datetime import datetime
 from backend.database import Base
 import enum
@@ -16,8 +16,9 @@ class Order(Base):
     date_of_order = Column(DateTime, default=datetime.now, nullable=False)
     status = Column(Enum(OrderStatus), default=OrderStatus.PENDING, nullable=False)
     description = Column(String(255), nullable=True)
-    id_port = Column(Integer, ForeignKey('port.id_port'), nullable=False)
-    id_client = Column(Integer, ForeignKey('client.id_client'), nullable=True)
+    id_port = Column(Integer, ForeignKey('port.id_port'), nullable=False, index=True)
+    id_client = Column(Integer, ForeignKey('client.id_client'), nullable=True, index=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     port = relationship("Port", back_populates="orders")
     client = relationship("Client", back_populates="orders")
@@ -25,8 +26,10 @@ class Order(Base):
     operations = relationship("Operation", back_populates="order")
     order_products = relationship("Order_product", back_populates="order")
 
-    # Placeholder for total price calculation
-    @property
-    def total_price(self):
-        # TO DO: Calculate total price based on OrderProduct details when available
-        return 0
+    # Aggregated by the database over order_products and product, see routes.order.query_orders
+    total_price = query_expression()
+    total_weight = query_expression()
+    item_count = query_expression()
+
+    # Updates through the ORM only apply to the version they read, see utils.concurrency
+    __mapper_args__ = {"version_id_col": version}
@@ -5,8 +5,11 @@ from sqlalchemy.orm import relationship
 class Order_product(Base):
     __tablename__ = 'order_products'
     id_order = Column(Integer, ForeignKey('order.id_order'), primary_key=True, nullable=False)
-    id_product = Column(Integer, ForeignKey('product.id_product'), primary_key=True, nullable=False)
+    id_product = Column(Integer, ForeignKey('product.id_product'), primary_key=True, nullable=False, index=True)
     quantity = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
     product = relationship("Product", back_populates="order_products")
     order = relationship("Order", back_populates="order_products")
+
+    __mapper_args__ = {"version_id_col": version}
@@ -13,7 +13,7 @@ class Product(Base):
     created_at = Column(DateTime, default=datetime.now())
     updated_at = Column(DateTime, default=datetime.now(), onupdate=datetime.now())
     image = Column(String, nullable=True)
-    id_port = Column(Integer, ForeignKey('port.id_port'), nullable=False)
+    id_port = Column(Integer, ForeignKey('port.id_port'), nullable=False, index=True)
 
     port = relationship("Port", back_populates="products")
 
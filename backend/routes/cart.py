@@ -1,12 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 from backend.models.order_product import Order_product
-from backend.models.order import Order
+from backend.models.order import Order, OrderStatus
 from backend.models.product import Product
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.logging_config import logger
-from pydantic import BaseModel
-from typing import List, Optional
+from backend.utils.references import reference_validator
+from backend.utils.bulk_import import chunks
+from backend.utils.concurrency import check_version, commit_versioned, if_match_version, set_version_etag
+from pydantic import BaseModel, Field
+from typing import Dict, List, Optional
 
 router = APIRouter()
 
@@ -21,6 +26,7 @@ class CartItemRead(BaseModel):
     id_order: int
     id_product: int
     quantity: int
+    version: int
 
     class Config:
         from_attributes = True
@@ -28,6 +34,10 @@ class CartItemRead(BaseModel):
 class CartItemUpdate(BaseModel):
     quantity: Optional[int] = None
 
+class CartLine(BaseModel):
+    id_product: int
+    quantity: int = Field(gt=0)
+
 
 def get_product_by_id(product_id: int, db: Session):
     product = db.query(Product).filter(Product.id_product == product_id).first()
@@ -43,14 +53,79 @@ def get_order_by_id(order_id: int, db: Session):
     return order
 
 
-def is_order_shipped(order: Order):
-    if order.status == "SHIPPED":
+def touch_open_order(order_id: int, db: Session, expected_version: Optional[int] = None) -> int:
+    """
+    Bump the version of an order whose cart is about to change, in the same transaction as the change.
+    The UPDATE only matches an order that is not shipped (and is at `expected_version`, when given), so
+    a cart change and a checkout cannot both succeed on the same version. Returns the new version.
+    """
+    statement = (
+        update(Order)
+        .where(Order.id_order == order_id, Order.status != OrderStatus.SHIPPED)
+        .values(version=Order.version + 1)
+        .returning(Order.version)
+        .execution_options(synchronize_session=False)
+    )
+    if expected_version is not None:
+        statement = statement.where(Order.version == expected_version)
+    version = db.execute(statement).scalar()
+    if version is not None:
+        return version
+
+    # Nothing matched, find out why
+    order = db.query(Order.status, Order.version).filter(Order.id_order == order_id).first()
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order.status == OrderStatus.SHIPPED:
         raise HTTPException(status_code=400, detail="Cannot modify a shipped order")
+    check_version(f"Order {order_id}", order.version, expected_version)
+    raise HTTPException(status_code=409, detail=f"Order {order_id} was changed by another request, reload it and retry")
+
+
+def merge_lines(lines: List[CartLine]) -> Dict[int, int]:
+    # A product listed twice is one cart line, ON CONFLICT cannot touch the same row twice in one statement
+    quantities: Dict[int, int] = {}
+    for line in lines:
+        quantities[line.id_product] = quantities.get(line.id_product, 0) + line.quantity
+    return quantities
+
+
+def require_products(db: Session, product_ids):
+    missing = reference_validator.find_missing(db, [(Product.id_product, product_ids)])[0]
+    if missing:
+        logger.error(f"Products not found: {sorted(missing)}")
+        raise HTTPException(status_code=404, detail=f"Products not found: {', '.join(map(str, sorted(missing)))}")
+
+
+def upsert_cart_lines(db: Session, id_order: int, quantities: Dict[int, int], replace: bool = False) -> list:
+    """
+    Write the cart lines of an order with INSERT ... ON CONFLICT DO UPDATE, so the database adds the
+    quantity to an existing line (or overwrites it when `replace`) and concurrent adds cannot lose updates.
+    Updated lines get a new version. Returns the written lines.
+    """
+    dialect = db.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    rows = [{"id_order": id_order, "id_product": id_product, "quantity": quantity}
+            for id_product, quantity in quantities.items()]
+    written = []
+    for chunk in chunks(rows):
+        statement = insert(Order_product).values(chunk)
+        quantity = statement.excluded.quantity if replace else Order_product.quantity + statement.excluded.quantity
+        statement = statement.on_conflict_do_update(
+            index_elements=[Order_product.id_order, Order_product.id_product],
+            set_={"quantity": quantity, "version": Order_product.version + 1},
+        ).returning(Order_product.id_order, Order_product.id_product, Order_product.quantity, Order_product.version)
+        written.extend(CartItemRead.model_validate(row) for row in db.execute(statement))
+    return written
 
 
 @router.get("/cart/{id_order}", response_model=List[CartItemRead])
-def get_cart_items(id_order: int, db: Session = Depends(get_db)):
+def get_cart_items(id_order: int, response: Response, db: Session = Depends(get_read_db)):
     logger.info(f"Fetching cart items for order ID: {id_order}")
+    # The cart is part of its order, the ETag is the order version
+    version = db.query(Order.version).filter(Order.id_order == id_order).scalar()
+    if version is not None:
+        set_version_etag(response, version)
     cart_items = db.query(Order_product).filter(Order_product.id_order == id_order).all()
     if not cart_items:
         logger.warning(f"No cart items found for order ID: {id_order}")
@@ -58,91 +133,118 @@ def get_cart_items(id_order: int, db: Session = Depends(get_db)):
 
 
 @router.post("/cart", response_model=CartItemRead)
-def add_to_cart(cart_item: CartItemCreate, db: Session = Depends(get_db)):
-    product = get_product_by_id(cart_item.id_product, db)
-
-    port_id = product.id_port if product.id_port else DEFAULT_PORT_ID
-    
+def add_to_cart(cart_item: CartItemCreate, response: Response,
+                expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
     if not cart_item.id_order:
-        new_order = Order(status="PENDING", id_port=port_id)
+        # The new order is placed in the port of the product
+        product = get_product_by_id(cart_item.id_product, db)
+        port_id = product.id_port if product.id_port else DEFAULT_PORT_ID
+        new_order = Order(status=OrderStatus.PENDING, id_port=port_id)
         db.add(new_order)
-        db.commit()
-        db.refresh(new_order)
+        db.flush()
         cart_item.id_order = new_order.id_order
+        version = new_order.version
         logger.info(f"Created a new order with ID: {new_order.id_order} and port ID: {port_id}")
+    else:
+        reference_validator.require(db, (Product.id_product, cart_item.id_product))
+        version = touch_open_order(cart_item.id_order, db, expected_version)
 
-    order = get_order_by_id(cart_item.id_order, db)
-    is_order_shipped(order)
-
-    existing_item = db.query(Order_product).filter(
-        Order_product.id_order == cart_item.id_order,
-        Order_product.id_product == cart_item.id_product
-    ).first()
-
-    if existing_item:
-        logger.info("Product already in cart, updating quantity")
-        existing_item.quantity += cart_item.quantity
-        db.commit()
-        db.refresh(existing_item)
-        return existing_item
-
-    new_cart_item = Order_product(
-        id_order=cart_item.id_order,
-        id_product=cart_item.id_product,
-        quantity=cart_item.quantity
-    )
-    db.add(new_cart_item)
+    # The order (when new) and the line are committed together
+    line = upsert_cart_lines(db, cart_item.id_order, {cart_item.id_product: cart_item.quantity})[0]
     db.commit()
-    db.refresh(new_cart_item)
-    logger.info(f"Added product {cart_item.id_product} to the cart for order {cart_item.id_order}")
-    return new_cart_item
+    set_version_etag(response, version)
+    logger.info(f"Added {cart_item.quantity} of product {cart_item.id_product} to the cart for order {cart_item.id_order}")
+    return line
+
+
+@router.put("/cart/{id_order}", response_model=List[CartItemRead])
+def replace_cart(id_order: int, lines: List[CartLine], response: Response,
+                 expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
+    logger.info(f"Replacing the cart of order {id_order} with {len(lines)} lines")
+    quantities = merge_lines(lines)
+    require_products(db, quantities)
+    version = touch_open_order(id_order, db, expected_version)
+
+    # Lines left out of the new cart are dropped, the others are overwritten in place
+    db.query(Order_product).filter(
+        Order_product.id_order == id_order,
+        Order_product.id_product.not_in(list(quantities)),
+    ).delete(synchronize_session=False)
+    written = upsert_cart_lines(db, id_order, quantities, replace=True)
+    db.commit()
+    set_version_etag(response, version)
+    logger.info(f"Cart of order {id_order} replaced, {len(written)} lines")
+    return sorted(written, key=lambda line: line.id_product)
+
+
+@router.post("/cart/{id_order}/items:batch", response_model=List[CartItemRead])
+def add_cart_items(id_order: int, lines: List[CartLine], response: Response,
+                   expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
+    if not lines:
+        raise HTTPException(status_code=400, detail="No cart lines given")
+    logger.info(f"Adding {len(lines)} lines to the cart of order {id_order}")
+    quantities = merge_lines(lines)
+    require_products(db, quantities)
+    version = touch_open_order(id_order, db, expected_version)
+
+    written = upsert_cart_lines(db, id_order, quantities)
+    db.commit()
+    set_version_etag(response, version)
+    logger.info(f"Added {len(written)} lines to the cart of order {id_order}")
+    return sorted(written, key=lambda line: line.id_product)
 
 
 @router.delete("/cart/{id_order}/{id_product}", response_model=dict)
-def remove_cart_item(id_order: int, id_product: int, db: Session = Depends(get_db)):
+def remove_cart_item(id_order: int, id_product: int, response: Response,
+                     expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
     logger.info(f"Removing product {id_product} from order {id_order}")
-    cart_item = db.query(Order_product).filter(
+    removed = db.query(Order_product).filter(
         Order_product.id_order == id_order,
         Order_product.id_product == id_product
-    ).first()
+    ).delete(synchronize_session=False)
 
-    if not cart_item:
+    if not removed:
         logger.error(f"Cart item not found for order {id_order} and product {id_product}")
         raise HTTPException(status_code=404, detail="Cart item not found")
 
-    db.delete(cart_item)
+    version = touch_open_order(id_order, db, expected_version)
     db.commit()
+    set_version_etag(response, version)
     logger.info(f"Product {id_product} removed from cart for order {id_order}")
     return {"message": "Cart item removed successfully"}
 
 
 @router.delete("/cart/{id_order}", response_model=dict)
-def clear_cart(id_order: int, db: Session = Depends(get_db)):
+def clear_cart(id_order: int, response: Response,
+               expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
     logger.info(f"Clearing cart for order {id_order}")
-    cart_items = db.query(Order_product).filter(Order_product.id_order == id_order).all()
+    removed = db.query(Order_product).filter(Order_product.id_order == id_order).delete(synchronize_session=False)
 
-    if not cart_items:
+    if not removed:
         logger.warning(f"No cart items found for order {id_order}")
         raise HTTPException(status_code=404, detail="Cart is already empty")
 
-    for item in cart_items:
-        db.delete(item)
-
+    version = touch_open_order(id_order, db, expected_version)
     db.commit()
+    set_version_etag(response, version)
     logger.info(f"All items removed from cart for order {id_order}")
     return {"message": f"All items removed from cart for order {id_order}"}
 
 
 @router.post("/checkout/{id_order}", response_model=dict)
-def checkout(id_order: int, db: Session = Depends(get_db)):
+def checkout(id_order: int, response: Response,
+             expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
     order = get_order_by_id(id_order, db)
+    check_version(f"Order {id_order}", order.version, expected_version)
 
-    cart_items = db.query(Order_product).filter(Order_product.id_order == id_order).all()
-    if not cart_items:
+    has_items = db.query(Order_product.id_order).filter(Order_product.id_order == id_order).first()
+    if not has_items:
         raise HTTPException(status_code=400, detail="Cart is empty")
 
-    order.status = "SHIPPED"
-    db.commit()
+    # Fails with 409 when the cart or the order changed since the order was read
+    order.status = OrderStatus.SHIPPED
+    commit_versioned(db, f"Order {id_order}")
+    set_version_etag(response, order.version)
     logger.info(f"Order {id_order} has been successfully checked out and shipped")
-    
+
     return {"message": f"Order {id_order} has been successfully checked out"}
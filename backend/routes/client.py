@@ -1,27 +1,40 @@
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Response, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, JWTError
 from backend.models.client import Client, UserRole
-from backend.database import get_db
+from backend.database import get_async_db, get_db, get_read_db
 from backend.logging_config import logger
 from dotenv import load_dotenv
-import bcrypt
 import os
+import time
 from datetime import datetime, timedelta
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 
 from backend.models.order import Order
-from backend.utils.role_validation import check_user_role
+from backend.utils.role_validation import Principal, check_user_role
+from backend.utils.cache import TTLCache
+from backend.utils.password_hashing import hash_password, needs_rehash, verify_password
+from backend.utils.pagination import PageParams, paginate
+from backend.utils.serialization import json_response, model_columns, row_dicts
 
-from backend.models.debl.email_block_list import email_block_list
+from backend.utils.domain_blocklist import domain_blocklist
 from email_validator import validate_email, EmailNotValidError
+from starlette.concurrency import run_in_threadpool
 
 load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "default-fallback-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 90
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("PRINCIPAL_CACHE_MAX_ENTRIES", 10000))
+
+# Verified token -> Principal, so authenticated requests need neither jwt.decode nor a SELECT on client.
+# Entries are dropped when the client is updated or deleted, the TTL bounds staleness across workers.
+principal_cache = TTLCache(max_entries=PRINCIPAL_CACHE_MAX_ENTRIES, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/clients/login")
@@ -79,14 +92,18 @@ class ClientDetailsDTO(BaseModel):
         orm_mode = True
 
 @router.get("/clients/{id_client}/details", response_model=ClientDetailsDTO)
-def get_client_details(id_client: int, db: Session = Depends(get_db)):
-    client = db.query(Client).filter(Client.id_client == id_client).first()
+def get_client_details(id_client: int, db: Session = Depends(get_read_db)):
+    # Klient razem z identyfikatorami zamówień w jednym zapytaniu
+    client = (
+        db.query(Client)
+        .options(joinedload(Client.orders).load_only(Order.id_order))
+        .filter(Client.id_client == id_client)
+        .first()
+    )
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    # Pobieranie zamówień związanych z klientem
-    orders = db.query(Order.id_order).filter(Order.id_client == id_client).all()
-    order_ids = [order.id_order for order in orders]
+    order_ids = [order.id_order for order in client.orders]
 
     return ClientDetailsDTO(
         id_client=client.id_client,
@@ -100,11 +117,29 @@ def get_client_details(id_client: int, db: Session = Depends(get_db)):
     )
 
 
-def authenticate_client(logon_name: str, password: str, db: Session):
-    client = db.query(Client).filter(Client.logon_name == logon_name).first()
-    if not client or not bcrypt.checkpw(password.encode('utf-8'), client.password.encode('utf-8')):
+# The routes hashing passwords are async so bcrypt runs in its own pool; their queries and commits still
+# block, so they go to the threadpool and a busy SQLite never stalls the event loop
+def _find_client(db: Session, *criteria) -> Optional[Client]:
+    return db.query(Client).filter(*criteria).first()
+
+
+def _save_client(db: Session, client: Client) -> Client:
+    db.add(client)
+    db.commit()
+    db.refresh(client)
+    return client
+
+
+async def authenticate_client(logon_name: str, password: str, db: Session):
+    client = await run_in_threadpool(_find_client, db, Client.logon_name == logon_name)
+    if not client or not await verify_password(password, client.password):
         logger.warning(f"Authentication failed for client: {logon_name}")
         return None
+    if needs_rehash(client.password):
+        # Hashes made with an older bcrypt cost are upgraded while we still have the plain password
+        logger.info(f"Rehashing password of client: {logon_name}")
+        client.password = await hash_password(password)
+        await run_in_threadpool(_save_client, db, client)
     return client
 
 def create_access_token(data: dict):
@@ -113,33 +148,74 @@ def create_access_token(data: dict):
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_client(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+def _token_client_id(token: str) -> tuple:
+    # The client id and the claims of a valid token
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        id_client = payload.get("sub")
-        if not id_client:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token: Missing 'sub' claim")
-        client = db.query(Client).filter(Client.id_client == int(id_client)).first()
-        if not client:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Client not found")
-        return client
     except JWTError as e:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Token validation failed: {str(e)}")
+    id_client = payload.get("sub")
+    if not id_client:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token: Missing 'sub' claim")
+    return int(id_client), payload
+
+
+def _remember_principal(token: str, payload: dict, client: Optional[Client]) -> Principal:
+    if not client:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Client not found")
+    principal = Principal.from_client(client)
+    # Never cache a token past its own expiry
+    principal_cache.set(token, principal, ttl=payload["exp"] - time.time() if "exp" in payload else None)
+    return principal
+
+
+def get_current_client(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    id_client, payload = _token_client_id(token)
+    client = db.query(Client).filter(Client.id_client == id_client).first()
+    return _remember_principal(token, payload, client)
+
+
+async def get_current_client_async(token: str = Depends(oauth2_scheme),
+                                   db: AsyncSession = Depends(get_async_db)) -> Principal:
+    # Same as get_current_client, for async routes: no threadpool slot, and no connection on a cache hit
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+    id_client, payload = _token_client_id(token)
+    client = (await db.execute(select(Client).where(Client.id_client == id_client))).scalars().first()
+    return _remember_principal(token, payload, client)
+
+
+def invalidate_client_principals(id_client: int):
+    dropped = principal_cache.pop_where(lambda token, principal: principal.id_client == id_client)
+    logger.info(f"Dropped {dropped} cached principals of client {id_client}")
 
 #CRUD TABELE OG z wcześniej:
 @router.get("/clients", response_model=List[ClientRead])
-def get_all_clients(db: Session = Depends(get_db), current_client=Depends(get_current_client)):
+def get_all_clients(response: Response, page: PageParams = Depends(), db: Session = Depends(get_read_db),
+                    current_client=Depends(get_current_client)):
     check_user_role(current_client, [UserRole.ADMIN, UserRole.CLIENT, UserRole.EMPLOYEE])
     logger.info("Getting all clients")
-    clients = db.query(Client).all()
-    return clients
+    clients, _ = paginate(db.query(*model_columns(ClientRead, Client)), [Client.id_client], page, response)
+    return json_response(row_dicts(clients), response)
 
 @router.get("/clients/me", response_model=ClientRead)
-def get_current_client_info(current_client: Client = Depends(get_current_client)):
-    return current_client
+def get_current_client_info(db: Session = Depends(get_read_db), current_client: Principal = Depends(get_current_client)):
+    db_client = db.query(Client).filter(Client.id_client == current_client.id_client).first()
+    if db_client is None:
+        raise HTTPException(status_code=404, detail="Client not found")
+    return db_client
+
+@router.get("/clients/auth_cache/stats", response_model=dict)
+def get_principal_cache_stats(current_client: Principal = Depends(get_current_client)):
+    check_user_role(current_client, [UserRole.ADMIN])
+    return principal_cache.stats()
 
 @router.get("/clients/{id_client}", response_model=ClientRead)
-def read_client(id_client: int, db: Session = Depends(get_db), current_client=Depends(get_current_client)):
+def read_client(id_client: int, db: Session = Depends(get_read_db), current_client=Depends(get_current_client)):
     check_user_role(current_client, [UserRole.ADMIN])
     logger.info(f"Reading client with id: {id_client}")
     db_client = db.query(Client).filter(Client.id_client == id_client).first()
@@ -148,30 +224,31 @@ def read_client(id_client: int, db: Session = Depends(get_db), current_client=De
         raise HTTPException(status_code=404, detail="Client not found")
     return db_client
 
-def is_disposable_email(email: str, db: Session) -> bool:
+def is_disposable_email(email: str) -> bool:
     try:
-        logger.info(f"Checking if email is disposable: {email}")
         validated_email = validate_email(email).email
-        logger.info(f"Validating email: {validated_email}")
         domain = validated_email.split('@')[-1].lower()
-        logger.info(f"Validating domain: {domain}")
-        is_blocked = db.query(email_block_list).filter(email_block_list.domain == domain).first() is not None
-        logger.info(f"Is domain blocked: {is_blocked}")
+        is_blocked = domain_blocklist.is_blocked(domain)
+        if is_blocked:
+            logger.info(f"Rejected disposable email domain: {domain}")
         return is_blocked
     except EmailNotValidError:
         logger.error(f"Email validation failed: {str(EmailNotValidError)}")
         raise HTTPException(status_code=400, detail="Invalid email format")
 @router.post("/clients", response_model=ClientRead)
-def create_client(
+async def create_client(
     client: ClientCreate,
     db: Session = Depends(get_db),
 ):
-    if is_disposable_email(client.email, db):
+    # validate_email resolves the domain, also kept off the event loop
+    if await run_in_threadpool(is_disposable_email, client.email):
         raise HTTPException(status_code=400, detail="Disposable email addresses are not allowed")
-    if db.query(Client).filter((Client.logon_name == client.logon_name) | (Client.email == client.email)).first():
+    if await run_in_threadpool(
+        _find_client, db, (Client.logon_name == client.logon_name) | (Client.email == client.email)
+    ):
         raise HTTPException(status_code=400, detail="Username or email already exists")
     logger.info(f"Creating new client: {client}")
-    hashed_password = bcrypt.hashpw(client.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    hashed_password = await hash_password(client.password)
     assert client.telephone_number is None or isinstance(client.telephone_number, int), "phone_no should be nullable or an integer"
     db_client = Client(
         name=client.name,
@@ -181,21 +258,18 @@ def create_client(
         logon_name=client.logon_name,
         password=hashed_password,
         role=client.role.value)
-    db.add(db_client)
-    db.commit()
-    db.refresh(db_client)
-    return db_client
+    return await run_in_threadpool(_save_client, db, db_client)
 
 @router.post("/clients/login")
-def login_client(client: ClientLogin, db: Session = Depends(get_db)):
-    db_client = authenticate_client(client.logon_name, client.password, db)
+async def login_client(client: ClientLogin, db: Session = Depends(get_db)):
+    db_client = await authenticate_client(client.logon_name, client.password, db)
     if not db_client:
         raise HTTPException(status_code=401, detail="Invalid username or password")
     token = create_access_token({"sub": str(db_client.id_client)})
     return {"access_token": token, "token_type": "bearer", "role": db_client.role.value}
 
 @router.put("/clients/{id_client}", response_model=ClientRead)
-def update_client(
+async def update_client(
     id_client: int,
     client: ClientUpdate,
     db: Session = Depends(get_db),
@@ -204,15 +278,16 @@ def update_client(
     check_user_role(current_client, [UserRole.ADMIN, UserRole.EMPLOYEE, UserRole.CLIENT])
     logger.info(f"Updating client with ID: {id_client}")
     if (current_client.role == UserRole.ADMIN or (current_client.id_client == id_client)):
-        db_client = db.query(Client).filter(Client.id_client == id_client).first()
+        db_client = await run_in_threadpool(_find_client, db, Client.id_client == id_client)
         if db_client is None:
             logger.warning(f"Client with ID: {id_client} not found")
             raise HTTPException(status_code=404, detail="Client not found")
 
         # Prevent duplicate logon_name or email
-        if db.query(Client).filter(
-            (Client.logon_name == client.logon_name) | (Client.email == client.email)
-        ).filter(Client.id_client != id_client).first():
+        if await run_in_threadpool(
+            _find_client, db, (Client.logon_name == client.logon_name) | (Client.email == client.email),
+            Client.id_client != id_client,
+        ):
             raise HTTPException(status_code=400, detail="Username or email already exists")
 
         # Update fields if provided
@@ -227,13 +302,13 @@ def update_client(
         if client.logon_name:
             db_client.logon_name = client.logon_name
         if client.password:
-            db_client.password = bcrypt.hashpw(client.password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            db_client.password = await hash_password(client.password)
         if client.role:
             db_client.role = client.role
 
         logger.info(f"Updated client fields: {client.dict(exclude_unset=True)}")
-        db.commit()
-        db.refresh(db_client)
+        await run_in_threadpool(_save_client, db, db_client)
+        invalidate_client_principals(id_client)
         return db_client
     else:
         logger.warning(f"Client with no admin role can't access other client data")
@@ -256,5 +331,6 @@ def delete_client(
         raise HTTPException(status_code=404, detail="Client not found")
     db.delete(db_client)
     db.commit()
+    invalidate_client_principals(id_client)
     return {"message": f"Client with ID {id_client} deleted successfully"}
 
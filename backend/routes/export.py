@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import DateTime, Enum as SqlEnum, select
+
+from backend.database import read_bind
+from backend.logging_config import logger
+from backend.models import Operation, Product, UserRole
+from backend.models.order import Order
+from backend.utils.role_validation import check_user_role
+from .client import get_current_client
+from .order import TOTAL_COLUMNS, OrderTotalsFilter
+
+router = APIRouter()
+
+load_dotenv()
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+
+class ExportEntity(str, Enum):
+    ORDERS = "orders"
+    OPERATIONS = "operations"
+    PRODUCTS = "products"
+
+
+class ExportFormat(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.NDJSON: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+}
+
+# Same fields as OrderRead, OperationRead and ProductRead
+EXPORT_COLUMNS = {
+    ExportEntity.ORDERS: [
+        Order.id_order, Order.status, Order.date_of_order, Order.description, Order.id_port, Order.id_client,
+        *TOTAL_COLUMNS.values(), Order.version,
+    ],
+    ExportEntity.OPERATIONS: [
+        Operation.id_operation, Operation.name_of_operation, Operation.operation_type, Operation.date_of_operation,
+        Operation.id_ship, Operation.id_port, Operation.id_order,
+    ],
+    ExportEntity.PRODUCTS: [
+        Product.id_product, Product.name, Product.price, Product.weight, Product.image, Product.id_port,
+    ],
+}
+
+# The filters of the list endpoints (/orders/port/{id}, /operations/ship/{id}, ...) each entity accepts
+EXPORT_FILTERS = {
+    ExportEntity.ORDERS: {"id_port": Order.id_port, "id_client": Order.id_client},
+    ExportEntity.OPERATIONS: {"id_port": Operation.id_port, "id_ship": Operation.id_ship, "id_order": Operation.id_order},
+    ExportEntity.PRODUCTS: {"id_port": Product.id_port},
+}
+DATE_COLUMNS = {
+    ExportEntity.ORDERS: Order.date_of_order,
+    ExportEntity.OPERATIONS: Operation.date_of_operation,
+}
+
+
+def _plain_rows(columns: list, rows) -> list:
+    # Enums and datetimes are turned into their JSON / CSV form, only in the columns that hold them
+    conversions = []
+    for index, column in enumerate(columns):
+        if isinstance(column.type, SqlEnum):
+            conversions.append((index, lambda value: value.value))
+        elif isinstance(column.type, DateTime):
+            conversions.append((index, lambda value: value.isoformat()))
+    if not conversions:
+        return rows
+    plain = []
+    for row in rows:
+        row = list(row)
+        for index, convert in conversions:
+            if row[index] is not None:
+                row[index] = convert(row[index])
+        plain.append(row)
+    return plain
+
+
+def _ndjson(names: list, rows) -> str:
+    return "".join(json.dumps(dict(zip(names, row)), separators=(",", ":")) + "\n" for row in rows)
+
+
+def _csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _stream(bind, statement, export_format: ExportFormat, compress: bool):
+    """
+    Encode the rows of `statement` batch by batch as they come off the cursor, so memory use does not
+    depend on the size of the table. Runs on its own connection, the request session is gone once
+    the response starts streaming.
+    """
+    # wbits=31 writes a gzip container instead of a raw zlib stream
+    compressor = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return compressor.compress(data) if compressor else data
+
+    rows_sent = 0
+    with bind.connect() as connection:
+        result = connection.execute(statement.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        names = list(result.keys())
+        if export_format == ExportFormat.CSV:
+            yield encode(_csv([names]))
+        for rows in result.partitions():
+            rows = _plain_rows(statement.selected_columns, rows)
+            chunk = encode(_ndjson(names, rows) if export_format == ExportFormat.NDJSON else _csv(rows))
+            rows_sent += len(rows)
+            if chunk:
+                yield chunk
+    if compressor:
+        yield compressor.flush()
+    logger.info(f"Export finished, {rows_sent} rows sent")
+
+
+@router.get("/export/{entity}")
+def export_entity(
+    entity: ExportEntity,
+    request: Request,
+    format: ExportFormat = ExportFormat.NDJSON,
+    id_port: Optional[int] = None,
+    id_client: Optional[int] = None,
+    id_ship: Optional[int] = None,
+    id_order: Optional[int] = None,
+    date_from: Optional[datetime] = Query(None, description="Only rows dated on or after this time"),
+    date_to: Optional[datetime] = Query(None, description="Only rows dated before this time"),
+    totals: OrderTotalsFilter = Depends(),
+    current_client=Depends(get_current_client),
+):
+    check_user_role(current_client, [UserRole.ADMIN])
+    logger.info(f"Exporting {entity.value} as {format.value}")
+
+    columns = EXPORT_COLUMNS[entity]
+    statement = select(*columns).order_by(columns[0])
+    if entity == ExportEntity.ORDERS:
+        statement = totals.apply(statement)
+    elif totals.is_set():
+        raise HTTPException(status_code=400, detail=f"Total filters only apply to orders, not {entity.value}")
+
+    filters = {"id_port": id_port, "id_client": id_client, "id_ship": id_ship, "id_order": id_order}
+    for name, value in filters.items():
+        if value is None:
+            continue
+        if name not in EXPORT_FILTERS[entity]:
+            raise HTTPException(status_code=400, detail=f"{name} is not a filter of {entity.value}")
+        statement = statement.where(EXPORT_FILTERS[entity][name] == value)
+
+    if date_from is not None or date_to is not None:
+        if entity not in DATE_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"{entity.value} cannot be filtered by date")
+        if date_from is not None:
+            statement = statement.where(DATE_COLUMNS[entity] >= date_from)
+        if date_to is not None:
+            statement = statement.where(DATE_COLUMNS[entity] < date_to)
+
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {"Content-Disposition": f'attachment; filename="{entity.value}.{format.value}"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    return StreamingResponse(_stream(read_bind(request), statement, format, compress), media_type=MEDIA_TYPES[format], headers=headers)
@@ -1,16 +1,23 @@
 from enum import Enum
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, status
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 from datetime import datetime
 from backend.models.operation import Operation, OperationType
-from backend.database import get_db
+from backend.database import get_async_db, get_db
 from backend.logging_config import logger
 from backend.utils.role_validation import check_user_role
+from backend.utils.bulk_import import BulkImportResult, chunks, import_rows, parse_records
+from backend.utils.pagination import PageParams, paginate_async
+from backend.utils.references import reference_validator
+from backend.utils.serialization import json_response, model_columns, row_dicts
 from pydantic import BaseModel
 from typing import List, Optional
 from ..models import Ship, Port, UserRole
-from .client import get_current_client
+from .client import get_current_client, get_current_client_async
 from ..models.order import Order
 
 router = APIRouter()
@@ -67,10 +74,24 @@ class OperationDetailsDTO(BaseModel):
         orm_mode = True
 
 
+def select_operation_rows():
+    # The fields of OperationRead as plain columns, for the list routes
+    return select(*model_columns(OperationRead, Operation))
+
+
+def select_operation_with_places(id_operation: int):
+    # Operation with its ship and port in one statement
+    return (
+        select(Operation)
+        .options(joinedload(Operation.ship), joinedload(Operation.port))
+        .where(Operation.id_operation == id_operation)
+    )
+
+
 @router.get("/operations/{id_operation}/details", response_model=OperationDetailsDTO)
-def get_operation_details(id_operation: int, db: Session = Depends(get_db)):
+async def get_operation_details(id_operation: int, db: AsyncSession = Depends(get_async_db)):
     # Fetch operation with related data using relationships
-    operation = db.query(Operation).filter(Operation.id_operation == id_operation).first()
+    operation = (await db.execute(select_operation_with_places(id_operation))).scalars().first()
 
     if not operation:
         raise HTTPException(status_code=404, detail="Operation not found")
@@ -94,60 +115,79 @@ def get_operation_details(id_operation: int, db: Session = Depends(get_db)):
 
 # Operations endpoints with role validation
 @router.get("/operations/port/{id_port}", response_model=List[OperationRead])
-def get_operations_by_port(
+async def get_operations_by_port(
     id_port: int,
-    db: Session = Depends(get_db),
-    current_client=Depends(get_current_client)
+    response: Response,
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+    current_client=Depends(get_current_client_async)
 ):
     check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN, UserRole.CLIENT])  # Validate roles
-    operations = db.query(Operation).filter(Operation.id_port == id_port).all()
+    operations, _ = await paginate_async(
+        db, select_operation_rows().where(Operation.id_port == id_port), [Operation.id_operation], page, response,
+        scalars=False,
+    )
     if not operations:
         raise HTTPException(status_code=404, detail=f"No operations found for port with id: {id_port}")
-    return operations
+    return json_response(row_dicts(operations), response)
 
 @router.get("/operations/ship/{id_ship}", response_model=List[OperationRead])
-def get_operations_by_ship(
+async def get_operations_by_ship(
     id_ship: int,
-    db: Session = Depends(get_db),
-    current_client=Depends(get_current_client)
+    response: Response,
+    page: PageParams = Depends(),
+    db: AsyncSession = Depends(get_async_db),
+    current_client=Depends(get_current_client_async)
 ):
     check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])  # Validate roles
-    operations = db.query(Operation).filter(Operation.id_ship == id_ship).all()
+    operations, _ = await paginate_async(
+        db, select_operation_rows().where(Operation.id_ship == id_ship), [Operation.id_operation], page, response,
+        scalars=False,
+    )
     if not operations:
         raise HTTPException(status_code=404, detail=f"No operations found for ship with id: {id_ship}")
-    return operations
+    return json_response(row_dicts(operations), response)
 
 @router.get("/operations/order/{id_order}", response_model=List[OperationRead])
-def get_operations_by_order(
+async def get_operations_by_order(
         id_order: int,
-        db: Session = Depends(get_db),
-        current_client=Depends(get_current_client)
+        response: Response,
+        page: PageParams = Depends(),
+        db: AsyncSession = Depends(get_async_db),
+        current_client=Depends(get_current_client_async)
 ):
     check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
-    operations = db.query(Operation).filter(Operation.id_order == id_order).all()
+    operations, _ = await paginate_async(
+        db, select_operation_rows().where(Operation.id_order == id_order), [Operation.id_operation], page, response,
+        scalars=False,
+    )
     if not operations:
         raise HTTPException(status_code=404, detail=f"No operations found for order with id: {id_order}")
-    return operations
+    return json_response(row_dicts(operations), response)
 
 @router.get("/operations/{id_operation}", response_model=OperationRead)
-def get_operation(
+async def get_operation(
     id_operation: int,
-    db: Session = Depends(get_db),
-    current_client=Depends(get_current_client)
+    db: AsyncSession = Depends(get_async_db),
+    current_client=Depends(get_current_client_async)
 ):
     check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])  # Validate roles
     logger.info(f"Fetching operation with ID {id_operation}")
-    operation = db.query(Operation).filter(Operation.id_operation == id_operation).first()
+    operation = await db.get(Operation, id_operation)
     if not operation:
         raise HTTPException(status_code=404, detail="Operation not found")
     return operation
 
 
 @router.get("/operations", response_model=List[OperationRead])
-def get_all_operations(db: Session = Depends(get_db), current_client=Depends(get_current_client)):
+async def get_all_operations(response: Response, page: PageParams = Depends(),
+                             db: AsyncSession = Depends(get_async_db),
+                             current_client=Depends(get_current_client_async)):
     check_user_role(current_client, [UserRole.ADMIN, UserRole.EMPLOYEE])
-    operations = db.query(Operation).all()
-    return operations
+    operations, _ = await paginate_async(
+        db, select_operation_rows(), [Operation.id_operation], page, response, scalars=False
+    )
+    return json_response(row_dicts(operations), response)
 
 
 @router.post("/operations", response_model=OperationRead)
@@ -175,22 +215,13 @@ def create_operation(
             detail="Duplicate operation detected",
         )
 
-    # Ship validation
-    ship = db.query(Ship).filter(Ship.id_ship == operation.id_ship).first()
-    if not ship:
-        logger.error(f"Ship with ID {operation.id_ship} not found")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ship not found")
-
-    # Port validation
-    port = db.query(Port).filter(Port.id_port == operation.id_port).first()
-    if not port:
-        logger.error(f"Port with ID {operation.id_port} not found")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Port not found")
-
-    order = db.query(Order).filter(Order.id_order == operation.id_order).first()
-    if not order:
-        logger.error(f"Order with ID {operation.id_order} not found")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order not found")
+    # Ship, port and order validation in one query
+    reference_validator.require(
+        db,
+        (Ship.id_ship, operation.id_ship),
+        (Port.id_port, operation.id_port),
+        (Order.id_order, operation.id_order),
+    )
 
     # Create operation
     try:
@@ -215,6 +246,42 @@ def create_operation(
         )
 
 
+def find_duplicate_operations(db: Session, rows: list) -> list:
+    # Same rule as create_operation, checked with one query over the orders of the batch.
+    # Repeats inside the upload count as duplicates of their first occurrence.
+    seen = set()
+    for chunk in chunks(sorted({values["id_order"] for _, values in rows})):
+        seen.update(
+            tuple(row) for row in db.query(
+                Operation.name_of_operation, Operation.id_ship, Operation.id_port, Operation.id_order
+            ).filter(Operation.id_order.in_(chunk))
+        )
+    duplicates = []
+    for number, values in rows:
+        key = (values["name_of_operation"], values["id_ship"], values["id_port"], values["id_order"])
+        if key in seen:
+            duplicates.append(number)
+        seen.add(key)
+    return duplicates
+
+
+@router.post("/operations/bulk", response_model=BulkImportResult)
+async def bulk_create_operations(
+    request: Request,
+    db: Session = Depends(get_db),
+    current_client=Depends(get_current_client)
+):
+    """Create operations from an NDJSON body, or CSV with Content-Type: text/csv, one OperationCreate per row."""
+    check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
+    records = parse_records(await request.body(), request.headers.get("content-type", ""))
+    return await run_in_threadpool(
+        import_rows, db, Operation, OperationCreate, records,
+        foreign_keys={"id_ship": Ship.id_ship, "id_port": Port.id_port, "id_order": Order.id_order},
+        find_duplicates=find_duplicate_operations,
+        prepare=lambda operation: {**operation.dict(), "date_of_operation": operation.date_of_operation or datetime.now()},
+    )
+
+
 @router.put("/operations/{id_operation}", response_model=OperationRead)
 def update_operation(
     id_operation: int,
@@ -228,6 +295,12 @@ def update_operation(
     if not db_operation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Operation not found")
 
+    reference_validator.require(
+        db,
+        (Ship.id_ship, operation.id_ship),
+        (Port.id_port, operation.id_port),
+        (Order.id_order, operation.id_order),
+    )
     for field, value in operation.dict(exclude_unset=True).items():
         setattr(db_operation, field, value)
 
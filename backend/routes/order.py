@@ -1,19 +1,136 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from enum import Enum
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload, with_expression
 from datetime import datetime
 from backend.models import Operation, Product
 from backend.models.order import Order, OrderStatus
 from backend.models.order_product import Order_product
 from backend.models.client import Client
-from backend.database import get_db
+from backend.database import get_async_db, get_db
 from backend.logging_config import logger
+from backend.utils.batch import batch_ids, in_request_order
+from backend.utils.bulk_import import BulkImportResult, import_rows, parse_records
+from backend.utils.concurrency import check_version, commit_versioned, if_match_version, set_version_etag
+from backend.utils.pagination import PageParams, paginate_async
+from backend.utils.references import reference_validator
+from backend.utils.response_cache import catalog_cache
+from backend.utils.serialization import json_response, model_columns, row_dicts
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from ..models import Ship, Port
-from .client import get_current_client
+from .client import get_current_client, get_current_client_async
 
 router = APIRouter()
 
+def _order_total(expression, empty):
+    # Correlated with the outer order, so a page only reads the order_products of its own orders (through their
+    # primary key) instead of aggregating the whole table. Orders without products count as empty.
+    total = (
+        select(func.sum(expression))
+        .join(Product, Product.id_product == Order_product.id_product)
+        .where(Order_product.id_order == Order.id_order)
+        .correlate(Order)
+        .scalar_subquery()
+    )
+    return func.coalesce(total, empty)
+
+
+# Price, weight and number of units of an order
+TOTAL_COLUMNS = {
+    "total_price": _order_total(Order_product.quantity * Product.price, 0.0).label("total_price"),
+    "total_weight": _order_total(Order_product.quantity * Product.weight, 0.0).label("total_weight"),
+    "item_count": _order_total(Order_product.quantity, 0).label("item_count"),
+}
+
+
+def _with_totals(query):
+    # Works on ORM queries and on select() statements alike
+    return query.options(*(with_expression(getattr(Order, name), column) for name, column in TOTAL_COLUMNS.items()))
+
+
+def query_orders(db: Session):
+    """Order query with total_price, total_weight and item_count loaded in the same statement."""
+    return _with_totals(db.query(Order))
+
+
+def select_orders():
+    """query_orders() as a select() statement, for the async routes."""
+    return _with_totals(select(Order))
+
+
+def select_order_rows():
+    """The fields of OrderRead as plain columns, totals included, for the list routes."""
+    return select(*model_columns(OrderRead, Order, **TOTAL_COLUMNS))
+
+
+def get_order_with_totals(db: Session, id_order: int) -> Optional[Order]:
+    # populate_existing, the order may already sit in the session without its totals
+    return query_orders(db).filter(Order.id_order == id_order).populate_existing().first()
+
+
+class OrderSortField(str, Enum):
+    ID_ORDER = "id_order"
+    TOTAL_PRICE = "total_price"
+    TOTAL_WEIGHT = "total_weight"
+    ITEM_COUNT = "item_count"
+
+
+class OrderTotalsFilter:
+    # Bounds on the computed totals, shared by the order list endpoints and the export
+    def __init__(
+        self,
+        min_total_price: Optional[float] = Query(None, ge=0),
+        max_total_price: Optional[float] = Query(None, ge=0),
+        min_total_weight: Optional[float] = Query(None, ge=0),
+        max_total_weight: Optional[float] = Query(None, ge=0),
+        min_item_count: Optional[int] = Query(None, ge=0),
+        max_item_count: Optional[int] = Query(None, ge=0),
+    ):
+        self.bounds = {
+            "total_price": (min_total_price, max_total_price),
+            "total_weight": (min_total_weight, max_total_weight),
+            "item_count": (min_item_count, max_item_count),
+        }
+
+    def is_set(self) -> bool:
+        return any(bound is not None for bounds in self.bounds.values() for bound in bounds)
+
+    def apply(self, query):
+        for name, (low, high) in self.bounds.items():
+            if low is not None:
+                query = query.filter(TOTAL_COLUMNS[name] >= low)
+            if high is not None:
+                query = query.filter(TOTAL_COLUMNS[name] <= high)
+        return query
+
+
+class OrderListParams:
+    # Sorting and filtering on the computed totals, shared by the order list endpoints
+    def __init__(
+        self,
+        sort: OrderSortField = OrderSortField.ID_ORDER,
+        descending: bool = False,
+        totals: OrderTotalsFilter = Depends(),
+    ):
+        self.sort = sort
+        self.descending = descending
+        self.totals = totals
+
+    async def apply(self, db: AsyncSession, statement, page: PageParams, response: Response):
+        statement = self.totals.apply(statement)
+        # id_order breaks ties between equal totals so the cursor stays unique
+        key_columns = [Order.id_order]
+        if self.sort != OrderSortField.ID_ORDER:
+            key_columns.insert(0, TOTAL_COLUMNS[self.sort.value])
+        orders, _ = await paginate_async(
+            db, statement, key_columns, page, response, descending=self.descending, scalars=False
+        )
+        return orders
+
 
 class OrderCreate(BaseModel):
     status: OrderStatus  # Ensure this is passed properly
@@ -41,6 +158,10 @@ class OrderRead(BaseModel):
     description: Optional[str]
     id_port: int
     id_client: int
+    total_price: float
+    total_weight: float
+    item_count: int
+    version: int
 
     class Config:
         orm_mode = True  # Ensures Pydantic works with ORM objects
@@ -75,6 +196,10 @@ class OrderDetailsDTO(BaseModel):
     date_of_order: datetime
     status: str
     description: Optional[str]
+    total_price: float
+    total_weight: float
+    item_count: int
+    version: int
     port: PortDTO
     client: Optional[ClientDTO]
     operations: List[OperationDTO]
@@ -84,92 +209,111 @@ class OrderDetailsDTO(BaseModel):
         orm_mode = True
 
 
-@router.get("/orders/{order_id}", response_model=OrderDetailsDTO)
-def get_order_details(order_id: int, db: Session = Depends(get_db)):
-    # Fetch the order
-    order = db.query(Order).filter(Order.id_order == order_id).first()
+def select_order_details():
+    # Order, totals, port, client and operations in one statement, the products in a second one
+    return select_orders().options(
+        joinedload(Order.port),
+        joinedload(Order.client),
+        joinedload(Order.operations),
+        selectinload(Order.order_products).joinedload(Order_product.product),
+    )
 
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
 
-    # Fetch related data
-    port = db.query(Port).filter(Port.id_port == order.id_port).first()
-    client = db.query(Client).filter(Client.id_client == order.id_client).first()
-    operations = db.query(Operation).filter(Operation.id_order == order.id_order).all()
-    products = (
-        db.query(Product)
-        .join(Order_product, Product.id_product == Order_product.id_product)
-        .filter(Order_product.id_order == order.id_order)
-        .all()
-    )
+def order_details(order: Order) -> dict:
+    """OrderDetailsDTO of `order` as plain dicts, rendered with json_response()."""
+    port = order.port
+    client = order.client
+    products = [order_product.product for order_product in order.order_products]
 
-    # Create and return the DTO response
-    return OrderDetailsDTO(
-        id_order=order.id_order,
-        date_of_order=order.date_of_order,
-        status=order.status.value,
-        description=order.description,
-        port=PortDTO(id_port=port.id_port, name=port.name),
-        client=ClientDTO(id_client=client.id_client, name=client.name) if client else None,
-        operations=[
-            OperationDTO(
-                id_operation=op.id_operation,
-                name=op.name_of_operation,
-                operation_type=op.operation_type.value,
-                date_of_operation=op.date_of_operation.isoformat()  # Format datetime to string
-            )
-            for op in operations
+    return {
+        "id_order": order.id_order,
+        "date_of_order": order.date_of_order,
+        "status": order.status,
+        "description": order.description,
+        "total_price": order.total_price,
+        "total_weight": order.total_weight,
+        "item_count": order.item_count,
+        "version": order.version,
+        "port": {"id_port": port.id_port, "name": port.name},
+        "client": {"id_client": client.id_client, "name": client.name} if client else None,
+        "operations": [
+            {
+                "id_operation": op.id_operation,
+                "name": op.name_of_operation,
+                "operation_type": op.operation_type,
+                "date_of_operation": op.date_of_operation,
+            }
+            for op in order.operations
         ],
-        products=[
-            ProductDTO(
-                id_product=product.id_product,
-                name=product.name,
-                price=product.price,
-                weight=product.weight
-            )
+        "products": [
+            {"id_product": product.id_product, "name": product.name, "price": product.price, "weight": product.weight}
             for product in products
-        ]
-    )
+        ],
+    }
 
 
+# Declared before /orders/{order_id}, otherwise "details" would be parsed as an order id
+@router.get("/orders/details", response_model=List[OrderDetailsDTO])
+async def get_orders_details(ids: List[int] = Depends(batch_ids), db: AsyncSession = Depends(get_async_db)):
+    # unique(), the joined operations repeat every order row
+    result = await db.execute(select_order_details().where(Order.id_order.in_(ids)))
+    orders = result.unique().scalars().all()
+    return json_response([order_details(order) for order in in_request_order(orders, ids, lambda order: order.id_order)])
+
+
+@router.get("/orders/{order_id}", response_model=OrderDetailsDTO)
+async def get_order_details(order_id: int, response: Response, db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select_order_details().where(Order.id_order == order_id))
+    order = result.unique().scalars().first()
+
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+
+    set_version_etag(response, order.version)
+    return json_response(order_details(order), response)
+
 
 @router.get("/orders/port/{id_port}", response_model=List[OrderRead])
-def read_orders_by_port(id_port: int, db: Session = Depends(get_db), current_client=Depends(get_current_client)):
-    orders = db.query(Order).filter(Order.id_port == id_port).all()
+async def read_orders_by_port(id_port: int, response: Response, page: PageParams = Depends(),
+                              params: OrderListParams = Depends(), db: AsyncSession = Depends(get_async_db),
+                              current_client=Depends(get_current_client_async)):
+    orders = await params.apply(db, select_order_rows().where(Order.id_port == id_port), page, response)
     if not orders:
         raise HTTPException(status_code=404, detail=f"No orders found for port with id: {id_port}")
-    return orders
+    return json_response(row_dicts(orders), response)
 
 
 @router.get("/orders/client/{id_client}", response_model=List[OrderRead])
-def read_orders_by_client(id_client: int, db: Session = Depends(get_db), current_client=Depends(get_current_client)):
-    orders = db.query(Order).filter(Order.id_client == id_client).all()
+async def read_orders_by_client(id_client: int, response: Response, page: PageParams = Depends(),
+                                params: OrderListParams = Depends(), db: AsyncSession = Depends(get_async_db),
+                                current_client=Depends(get_current_client_async)):
+    orders = await params.apply(db, select_order_rows().where(Order.id_client == id_client), page, response)
     if not orders:
         raise HTTPException(status_code=404, detail=f"No orders found for client with id: {id_client}")
-    return orders
+    return json_response(row_dicts(orders), response)
 
 
 @router.get("/orders", response_model=List[OrderRead])
-def get_all_orders(db: Session = Depends(get_db), current_client=Depends(get_current_client)):
+async def get_all_orders(response: Response, page: PageParams = Depends(), params: OrderListParams = Depends(),
+                         db: AsyncSession = Depends(get_async_db), current_client=Depends(get_current_client_async)):
     logger.info("Getting all orders")
-    orders = db.query(Order).all()
-    return orders
+    orders = await params.apply(db, select_order_rows(), page, response)
+    return json_response(row_dicts(orders), response)
 
 
 @router.post("/orders", response_model=OrderRead)
 def create_order(order: OrderCreate, db: Session = Depends(get_db), current_client=Depends(get_current_client)):
+    logger.info(f"Received data for creating order: {order.dict()}")
+    reference_validator.require(db, (Port.id_port, order.id_port), (Client.id_client, order.id_client))
     try:
-        logger.info(f"Received data for creating order: {order.dict()}")
-
         # Create Order using the Pydantic OrderCreate model
         db_order = Order(**order.dict())
 
         db.add(db_order)
         db.commit()
-        db.refresh(db_order)
 
         logger.info(f"Order created successfully with id {db_order.id_order}")
-        return db_order
+        return get_order_with_totals(db, db_order.id_order)
 
     except Exception as e:
         logger.error(f"Error creating order: {e}")
@@ -177,6 +321,16 @@ def create_order(order: OrderCreate, db: Session = Depends(get_db), current_clie
         raise HTTPException(status_code=400, detail=f"Failed to create order. {str(e)}")
 
 
+@router.post("/orders/bulk", response_model=BulkImportResult)
+async def bulk_create_orders(request: Request, db: Session = Depends(get_db), current_client=Depends(get_current_client)):
+    """Create orders from an NDJSON body, or CSV with Content-Type: text/csv, one OrderCreate per row."""
+    records = parse_records(await request.body(), request.headers.get("content-type", ""))
+    return await run_in_threadpool(
+        import_rows, db, Order, OrderCreate, records,
+        foreign_keys={"id_port": Port.id_port, "id_client": Client.id_client},
+    )
+
+
 # Commented out due to making details for Order
 # @router.get("/orders/{id_order}", response_model=OrderRead)
 # def read_order(id_order: int, db: Session = Depends(get_db), current_client=Depends(get_current_client)):
@@ -189,19 +343,23 @@ def create_order(order: OrderCreate, db: Session = Depends(get_db), current_clie
 
 
 @router.put("/orders/{id_order}", response_model=OrderRead)
-def update_order(id_order: int, order: OrderUpdate, db: Session = Depends(get_db),
+def update_order(id_order: int, order: OrderUpdate, response: Response,
+                 expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db),
                  current_client=Depends(get_current_client)):
     logger.info(f"Updating order with id: {id_order}")
     db_order = db.query(Order).filter(Order.id_order == id_order).first()
     if db_order is None:
         logger.error(f"Order with id: {id_order} not found")
         raise HTTPException(status_code=404, detail="Order not found")
+    check_version(f"Order {id_order}", db_order.version, expected_version)
 
+    reference_validator.require(db, (Port.id_port, order.id_port), (Client.id_client, order.id_client))
     for key, value in order.dict(exclude_unset=True).items():
         setattr(db_order, key, value)
 
-    db.commit()
-    db.refresh(db_order)
+    commit_versioned(db, f"Order {id_order}")
+    db_order = get_order_with_totals(db, id_order)
+    set_version_etag(response, db_order.version)
     return db_order
 
 
@@ -215,6 +373,7 @@ def delete_order(id_order: int, db: Session = Depends(get_db), current_client=De
         logger.error(f"Order with id: {id_order} not found")
         raise HTTPException(status_code=404, detail="Order not found")
 
+    products_deleted = False
     # Check if the order status is 'delivered' or 'cancelled'
     if db_order.status in [OrderStatus.DELIVERED, OrderStatus.CANCELLED]:
         logger.info(f"Order with id: {id_order} has status '{db_order.status}', fetching linked products to delete")
@@ -228,6 +387,7 @@ def delete_order(id_order: int, db: Session = Depends(get_db), current_client=De
 
             # Step 2: Delete products linked to this order from the Product table
             db.query(Product).filter(Product.id_product.in_(product_ids)).delete(synchronize_session=False)
+            products_deleted = True
 
     # Step 3: Delete all Order_product entries linked to the order
     logger.info(f"Deleting Order_product records for order id: {id_order}")
@@ -241,8 +401,10 @@ def delete_order(id_order: int, db: Session = Depends(get_db), current_client=De
     logger.info(f"Deleting the order with id: {id_order}")
     db.delete(db_order)
 
-    # Commit all changes to the database
-    db.commit()
+    # Commit all changes to the database, the DELETE of the versioned order fails if a cart change bumped it meanwhile
+    commit_versioned(db, f"Order {id_order}")
+    if products_deleted:
+        catalog_cache.invalidate("products")
 
     logger.info(f"Order with id: {id_order} deleted successfully")
     return {
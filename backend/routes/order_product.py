@@ -1,8 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
+from backend.models.order import Order
 from backend.models.order_product import Order_product
-from backend.database import get_db
+from backend.models.product import Product
+from backend.database import get_db, get_read_db
 from backend.logging_config import logger
+from backend.routes.cart import touch_open_order
+from backend.utils.concurrency import check_version, commit_versioned, if_match_version, set_version_etag
+from backend.utils.pagination import PageParams, paginate
+from backend.utils.references import reference_validator
+from backend.utils.serialization import json_response, model_columns, row_dicts
 from pydantic import BaseModel
 from typing import List, Optional
 
@@ -22,19 +29,28 @@ class Order_productRead(BaseModel):
     id_order: int
     id_product: int
     quantity: int
+    version: int
 
     class Config:
         from_attributes = True
 
 @router.get("/orders_products", response_model=List[Order_productRead])
-def get_all_orders_products(db: Session = Depends(get_db)):
+def get_all_orders_products(response: Response, page: PageParams = Depends(), db: Session = Depends(get_read_db)):
     logger.info("Getting all orders_products")
-    orders_products = db.query(Order_product).all()
-    return orders_products
+    orders_products, _ = paginate(
+        db.query(*model_columns(Order_productRead, Order_product)),
+        [Order_product.id_order, Order_product.id_product], page, response
+    )
+    return json_response(row_dicts(orders_products), response)
 
 @router.post("/orders_products", response_model=Order_productRead)
 def create_order_product(order_product: Order_productCreate, db: Session = Depends(get_db)):
     logger.info(f"Received data for creating order_product: {order_product.dict()}")
+    reference_validator.require(
+        db, (Order.id_order, order_product.id_order), (Product.id_product, order_product.id_product)
+    )
+    # The order version moves with its lines, a checkout read before this change then fails with 409
+    touch_open_order(order_product.id_order, db)
     db_order_product = Order_product(**order_product.dict())
     db.add(db_order_product)
     db.commit()
@@ -42,7 +58,7 @@ def create_order_product(order_product: Order_productCreate, db: Session = Depen
     return db_order_product
 
 @router.get("/orders_products/{id_order}_{id_product}", response_model=Order_productRead)
-def get_order_product(id_order: int, id_product: int, db: Session = Depends(get_db)):
+def get_order_product(id_order: int, id_product: int, response: Response, db: Session = Depends(get_read_db)):
     logger.info(f"Reading order_product with ids: {id_order} {id_product}")
     db_order_product = db.query(Order_product).filter(
         Order_product.id_order == id_order).filter(
@@ -50,17 +66,18 @@ def get_order_product(id_order: int, id_product: int, db: Session = Depends(get_
     if db_order_product is None:
         call_out_missing_id(id_order, id_product, db)
         raise HTTPException(status_code=404, detail="Order not found")
+    set_version_etag(response, db_order_product.version)
     return db_order_product
 
 @router.get("/orders_products/order/{id_order}", response_model=List[Order_productRead])
-def get_order_product_by_order(id_order: int, db: Session = Depends(get_db)):
+def get_order_product_by_order(id_order: int, db: Session = Depends(get_read_db)):
     db_order_product = db.query(Order_product).filter(Order_product.id_order == id_order).all()
     if not db_order_product:
         raise HTTPException(status_code=404, detail="No order_products found with this order ID: {id_order}")
     return db_order_product
 
 @router.get("/orders_products/product/{id_product}", response_model=List[Order_productRead])
-def get_order_product_by_product(id_product: int, db: Session = Depends(get_db)):
+def get_order_product_by_product(id_product: int, db: Session = Depends(get_read_db)):
     logger.info(f"Reading order_product with product id: {id_product}")
     db_order_product = db.query(Order_product).filter(
         Order_product.id_product == id_product).all()
@@ -70,7 +87,8 @@ def get_order_product_by_product(id_product: int, db: Session = Depends(get_db))
     return db_order_product
 
 @router.put("/orders_products/{id_order}_{id_product}", response_model=Order_productRead)
-def update_order_product(id_order: int, id_product: int, order_product: Order_productUpdate, db: Session = Depends(get_db)):
+def update_order_product(id_order: int, id_product: int, order_product: Order_productUpdate, response: Response,
+                         expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
     logger.info(f"Updating order_product with id: {id_order}")
     db_order_product = db.query(Order_product).filter(
         Order_product.id_order == id_order).filter(
@@ -78,7 +96,14 @@ def update_order_product(id_order: int, id_product: int, order_product: Order_pr
     if db_order_product is None:
         call_out_missing_id(id_order, id_product, db)
         raise HTTPException(status_code=404, detail="Order not found")
-
+    check_version(f"Order_product {id_order}_{id_product}", db_order_product.version, expected_version)
+
+    reference_validator.require(
+        db, (Order.id_order, order_product.id_order), (Product.id_product, order_product.id_product)
+    )
+    touch_open_order(id_order, db)
+    if order_product.id_order is not None and order_product.id_order != id_order:
+        touch_open_order(order_product.id_order, db)
     if order_product.id_order is not None:
         db_order_product.id_order = order_product.id_order
     if order_product.id_product is not None:
@@ -86,12 +111,14 @@ def update_order_product(id_order: int, id_product: int, order_product: Order_pr
     if order_product.quantity is not None:
         db_order_product.quantity = order_product.quantity
 
-    db.commit()
+    commit_versioned(db, f"Order_product {id_order}_{id_product}")
     db.refresh(db_order_product)
+    set_version_etag(response, db_order_product.version)
     return db_order_product
 
 @router.delete("/orders_products/{id_order}_{id_product}", response_model=dict)
-def delete_order_product(id_order: int, id_product: int,db: Session = Depends(get_db)):
+def delete_order_product(id_order: int, id_product: int,
+                         expected_version: Optional[int] = Depends(if_match_version), db: Session = Depends(get_db)):
     logger.info(f"Deleting order with order id: {id_order} and product id: {id_product}")
     db_order_product = db.query(Order_product).filter(
         Order_product.id_order == id_order).filter(
@@ -99,9 +126,11 @@ def delete_order_product(id_order: int, id_product: int,db: Session = Depends(ge
     if db_order_product is None:
         call_out_missing_id(id_order, id_product, db)
         raise HTTPException(status_code=404, detail="Order not found")
+    check_version(f"Order_product {id_order}_{id_product}", db_order_product.version, expected_version)
 
+    touch_open_order(id_order, db)
     db.delete(db_order_product)
-    db.commit()
+    commit_versioned(db, f"Order_product {id_order}_{id_product}")
     return {
         "message": "Order_product deleted successfully",
         "order": Order_productRead.from_orm(db_order_product)
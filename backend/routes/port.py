@@ -1,13 +1,21 @@
-from fastapi import APIRouter, HTTPException, Depends
+from datetime import datetime
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from sqlalchemy import func, select, union_all
 from sqlalchemy.orm import Session
 
 from backend.models import Operation, Product
 from backend.models.order import Order
 from backend.models.order_product import Order_product
 from backend.models.port import Port
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.logging_config import logger
 from backend.utils.role_validation import check_user_role
+from backend.utils.batch import batch_ids, in_request_order
+from backend.utils.references import reference_validator
+from backend.utils.pagination import MAX_PAGE_SIZE, PageParams, encode_cursor, paginate
+from backend.utils.response_cache import catalog_cache
+from backend.utils.serialization import json_response, model_columns, row_dicts
 from pydantic import BaseModel, constr
 from typing import List, Optional
 from .client import get_current_client
@@ -66,73 +74,198 @@ class PortDetailsDTO(BaseModel):
     name: str
     location: str
     country: str
+    # Only the first `preview` rows of each sub-collection are embedded, the rest is paged through
+    # /ports/{id_port}/operations, /orders and /products starting at the matching *_next_cursor
+    operations_count: int
+    orders_count: int
+    products_count: int
     operations: List[OperationDTO]
     orders: List[OrderDTO]
     products: List[ProductDTO]
+    operations_next_cursor: Optional[str] = None
+    orders_next_cursor: Optional[str] = None
+    products_next_cursor: Optional[str] = None
 
     class Config:
         orm_mode = True
 
+
+PORT_DETAILS_PREVIEW = 20
+PREVIEW_QUERY = Query(
+    PORT_DETAILS_PREVIEW, ge=0, le=MAX_PAGE_SIZE, description="Rows of each sub-collection embedded per port"
+)
+
+# Sub-collections of a port: model, foreign key to the port, the keyset columns they are paged by
+# (all of them fields of the DTO) and the DTO of one row
+PORT_COLLECTIONS = {
+    "operations": (Operation, Operation.id_port, [Operation.date_of_operation, Operation.id_operation], OperationDTO),
+    "orders": (Order, Order.id_port, [Order.id_order], OrderDTO),
+    "products": (Product, Product.id_port, [Product.id_product], ProductDTO),
+}
+
+
+def _first_rows(db: Session, name: str, port_ids: List[int], limit: int) -> dict:
+    # One limited branch per port glued with UNION ALL: each branch walks its index and stops after `limit`
+    # rows, however many rows the port has. Returns {id_port: [DTO dicts in keyset order]}.
+    model, foreign_key, key_columns, dto = PORT_COLLECTIONS[name]
+    columns = model_columns(dto, model)
+    branches = [
+        select(foreign_key, *columns).where(foreign_key == id_port).order_by(*key_columns).limit(limit).subquery().select()
+        for id_port in port_ids
+    ]
+    statement = branches[0] if len(branches) == 1 else union_all(*branches)
+    keys = list(dto.model_fields)
+    rows = {}
+    for id_port, *values in db.execute(statement):
+        rows.setdefault(id_port, []).append(dict(zip(keys, values)))
+    return rows
+
+
+def load_port_details(db: Session, port_ids: List[int], preview: int) -> List[dict]:
+    """
+    PortDetailsDTO dicts of the given ports, rendered with json_response(): one statement for the ports and
+    counts plus one per sub-collection.
+    """
+    counts = [
+        select(func.count()).where(foreign_key == Port.id_port).correlate(Port).scalar_subquery()
+        for _, foreign_key, _, _ in PORT_COLLECTIONS.values()
+    ]
+    ports = db.query(Port, *counts).filter(Port.id_port.in_(port_ids)).all()
+    if not ports:
+        return []
+
+    found_ids = [port.id_port for port, *_ in ports]
+    previews = {name: _first_rows(db, name, found_ids, preview) if preview else {} for name in PORT_COLLECTIONS}
+
+    details = []
+    for port, *collection_counts in ports:
+        fields = {"id_port": port.id_port, "name": port.name, "location": port.location, "country": port.country}
+        for (name, (_, _, key_columns, _)), count in zip(PORT_COLLECTIONS.items(), collection_counts):
+            rows = previews[name].get(port.id_port, [])
+            fields[f"{name}_count"] = count
+            fields[name] = rows
+            fields[f"{name}_next_cursor"] = (
+                encode_cursor([rows[-1][column.key] for column in key_columns]) if rows and count > len(rows) else None
+            )
+        # In the field order of the DTO, like the response_model would render it
+        details.append({name: fields[name] for name in PortDetailsDTO.model_fields})
+    return details
+
+
+def ensure_port_exists(db: Session, id_port: int):
+    if db.query(Port.id_port).filter(Port.id_port == id_port).first() is None:
+        logger.warning(f"Port with id: {id_port} not found")
+        raise HTTPException(status_code=404, detail="Port not found")
+
+
+@router.get("/ports/details", response_model=List[PortDetailsDTO])
+def get_ports_details(
+    ids: List[int] = Depends(batch_ids),
+    preview: int = PREVIEW_QUERY,
+    db: Session = Depends(get_read_db),
+    current_client = Depends(get_current_client)
+):
+    check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
+    logger.info(f"Fetching details for {len(ids)} ports")
+    return json_response(in_request_order(load_port_details(db, ids, preview), ids, lambda port: port["id_port"]))
+
+
 @router.get("/ports/{id_port}/details", response_model=PortDetailsDTO)
 def get_port_details(
     id_port: int,
-    db: Session = Depends(get_db),
+    preview: int = PREVIEW_QUERY,
+    db: Session = Depends(get_read_db),
     current_client = Depends(get_current_client)
 ):
     check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
     logger.info(f"Fetching details for port with id: {id_port}")
-    port = db.query(Port).filter(Port.id_port == id_port).first()
+    details = load_port_details(db, [id_port], preview)
 
-    if not port:
+    if not details:
         logger.warning(f"Port with id: {id_port} not found")
         raise HTTPException(status_code=404, detail="Port not found")
 
-    # Fetch related data
-    operations = db.query(Operation).filter(Operation.id_port == id_port).all()
-    orders = db.query(Order).filter(Order.id_port == id_port).all()
-    products = db.query(Product).filter(Product.id_port == id_port).all()
-
-    return PortDetailsDTO(
-        id_port=port.id_port,
-        name=port.name,
-        location=port.location,
-        country=port.country,
-        operations=[
-            OperationDTO(
-                id_operation=op.id_operation,
-                name_of_operation=op.name_of_operation,
-                operation_type=op.operation_type.value,
-                date_of_operation=op.date_of_operation.isoformat()
-            )
-            for op in operations
-        ],
-        orders=[
-            OrderDTO(id_order=order.id_order, description=order.description, status=order.status.value)
-            for order in orders
-        ],
-        products=[
-            ProductDTO(id_product=product.id_product, name=product.name, price=product.price, weight=product.weight)
-            for product in products
-        ]
-    )
+    return json_response(details[0])
 
 
+@router.get("/ports/{id_port}/operations", response_model=List[OperationDTO])
+def get_port_operations(
+    id_port: int,
+    response: Response,
+    page: PageParams = Depends(),
+    date_from: Optional[datetime] = Query(None, description="Only operations on or after this time"),
+    date_to: Optional[datetime] = Query(None, description="Only operations before this time"),
+    db: Session = Depends(get_read_db),
+    current_client = Depends(get_current_client)
+):
+    check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
+    model, foreign_key, key_columns, dto = PORT_COLLECTIONS["operations"]
+    query = db.query(*model_columns(dto, model)).filter(foreign_key == id_port)
+    if date_from is not None:
+        query = query.filter(Operation.date_of_operation >= date_from)
+    if date_to is not None:
+        query = query.filter(Operation.date_of_operation < date_to)
+    operations, _ = paginate(query, key_columns, page, response)
+    if not operations:
+        ensure_port_exists(db, id_port)
+    return json_response(row_dicts(operations), response)
+
+
+@router.get("/ports/{id_port}/orders", response_model=List[OrderDTO])
+def get_port_orders(
+    id_port: int,
+    response: Response,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+    current_client = Depends(get_current_client)
+):
+    check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
+    model, foreign_key, key_columns, dto = PORT_COLLECTIONS["orders"]
+    query = db.query(*model_columns(dto, model)).filter(foreign_key == id_port)
+    orders, _ = paginate(query, key_columns, page, response)
+    if not orders:
+        ensure_port_exists(db, id_port)
+    return json_response(row_dicts(orders), response)
+
+
+@router.get("/ports/{id_port}/products", response_model=List[ProductDTO])
+def get_port_products(
+    id_port: int,
+    response: Response,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_read_db),
+    current_client = Depends(get_current_client)
+):
+    check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
+    model, foreign_key, key_columns, dto = PORT_COLLECTIONS["products"]
+    query = db.query(*model_columns(dto, model)).filter(foreign_key == id_port)
+    products, _ = paginate(query, key_columns, page, response)
+    if not products:
+        ensure_port_exists(db, id_port)
+    return json_response(row_dicts(products), response)
+
 
 @router.get("/ports", response_model=List[PortRead])
 def get_all_ports(
-    db: Session = Depends(get_db),
+    request: Request,
+    response: Response,
+    page: PageParams = Depends(),
+    db: Session = Depends(get_read_db),
     current_client = Depends(get_current_client)
 ):
     check_user_role(current_client, [UserRole.CLIENT, UserRole.EMPLOYEE, UserRole.ADMIN])
     logger.info("Getting all ports")
-    ports = db.query(Port).all()
-    return ports
+    cached = catalog_cache.lookup("ports", request)
+    if cached is not None:
+        return cached
+    ports, _ = paginate(db.query(Port), [Port.id_port], page, response)
+    return catalog_cache.store("ports", request, List[PortRead], ports, response)
 
 
 @router.get("/ports/{id_port}", response_model=PortRead)
 def read_port(
     id_port: int,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_client = Depends(get_current_client)
 ):
     check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
@@ -155,6 +288,7 @@ def create_port(
     db_port = Port(**port.dict())
     db.add(db_port)
     db.commit()
+    catalog_cache.invalidate("ports")
     db.refresh(db_port)
     return db_port
 
@@ -181,6 +315,7 @@ def update_port(
         db_port.country = port.country
 
     db.commit()
+    catalog_cache.invalidate("ports")
     db.refresh(db_port)
     return db_port
 
@@ -210,6 +345,8 @@ def delete_port(
 
     db.delete(db_port)
     db.commit()
+    catalog_cache.invalidate("ports")
+    reference_validator.forget(Port.id_port, id_port)
     return {
         "message": "Port deleted successfully",
         "port": PortRead.from_orm(db_port)
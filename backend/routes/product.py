@@ -1,18 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload
 
 from backend.models import Order_product, Port
-from backend.models.order import Order
 from backend.models.product import Product
-from backend.database import get_db
+from backend.database import get_async_db, get_db, get_read_db
 from backend.logging_config import logger
-from pydantic import BaseModel
+from backend.utils.batch import batch_ids, in_request_order
+from backend.utils.pagination import PageParams, paginate, paginate_async
+from backend.utils.references import reference_validator
+from backend.utils.response_cache import catalog_cache
+from pydantic import BaseModel, computed_field
 from typing import List, Optional
-from fastapi.responses import FileResponse, StreamingResponse
-import base64
-from io import BytesIO
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 import os
 from pathlib import Path
+from backend.utils.blob_store import blob_exists, inline_image, save_blob, store_image
+from backend.utils.image_variants import ImageSize, variant_response
 
 router = APIRouter()
 uploads_dir = Path(__file__).resolve().parent.parent / 'uploads'
@@ -36,8 +42,14 @@ class ProductRead(BaseModel):
     name: str
     price: float
     weight: float
-    image: str
+    image: str  # sha256 of the image in the blob store, "" when there is none
     id_port: int
+    image_data: Optional[str] = None  # base64 image, only filled in with ?include_image=true
+
+    @computed_field
+    @property
+    def image_url(self) -> Optional[str]:
+        return f"/api/products/image/{self.id_product}" if self.image else None
 
     class Config:
         from_attributes = True
@@ -51,30 +63,43 @@ class ProductDetailsDTO(BaseModel):
     port: str
     port_id: int  # Dodano ID portu
     orders: List[int]
+    image_data: Optional[str] = None
+
+    @computed_field
+    @property
+    def image_url(self) -> Optional[str]:
+        return f"/api/products/image/{self.id_product}" if self.image else None
 
     class Config:
         orm_mode = True
 
 
-@router.get("/products/{id_product}/details", response_model=ProductDetailsDTO)
-def get_product_details(id_product: int, db: Session = Depends(get_db)):
-    # Pobranie produktu
-    product = db.query(Product).filter(Product.id_product == id_product).first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+INCLUDE_IMAGE_QUERY = Query(False, description="Embed the base64 image in the response")
 
-    # Pobranie zamówień powiązanych z produktem
-    orders = (
-        db.query(Order.id_order)
-        .join(Order_product, Order.id_order == Order_product.id_order)
-        .filter(Order_product.id_product == id_product)
-        .all()
-    )
-    order_ids = [order.id_order for order in orders]
 
-    # Pobranie danych portu
-    port = db.query(Port).filter(Port.id_port == product.id_port).first()
+def with_image_data(products, include_image: bool):
+    if not include_image:
+        return products
+    return [
+        ProductRead.model_validate(product).model_copy(update={"image_data": inline_image(product.image)})
+        for product in products
+    ]
 
+
+async def with_image_data_async(products, include_image: bool):
+    # Images are read from disk, off the event loop
+    if not include_image:
+        return products
+    return await run_in_threadpool(with_image_data, products, include_image)
+
+
+def select_product_details():
+    # Produkt razem z portem i zamówieniami w jednym zapytaniu
+    return select(Product).options(joinedload(Product.port), joinedload(Product.order_products))
+
+
+def product_details_dto(product: Product, include_image: bool) -> ProductDetailsDTO:
+    port = product.port
     return ProductDetailsDTO(
         id_product=product.id_product,
         name=product.name,
@@ -83,62 +108,107 @@ def get_product_details(id_product: int, db: Session = Depends(get_db)):
         image=product.image,
         port=port.name if port else "Unknown",
         port_id=port.id_port if port else None,  # Dodano port_id
-        orders=order_ids,
+        orders=[order_product.id_order for order_product in product.order_products],
+        image_data=inline_image(product.image) if include_image else None,
     )
 
 
+@router.get("/products/details", response_model=List[ProductDetailsDTO])
+async def get_products_details(ids: List[int] = Depends(batch_ids), include_image: bool = INCLUDE_IMAGE_QUERY,
+                               db: AsyncSession = Depends(get_async_db)):
+    # unique(), the joined order_products repeat every product row
+    result = await db.execute(select_product_details().where(Product.id_product.in_(ids)))
+    products = in_request_order(result.unique().scalars().all(), ids, lambda product: product.id_product)
+    if include_image:
+        return await run_in_threadpool(lambda: [product_details_dto(product, True) for product in products])
+    return [product_details_dto(product, False) for product in products]
+
+
+@router.get("/products/{id_product}/details", response_model=ProductDetailsDTO)
+async def get_product_details(id_product: int, include_image: bool = INCLUDE_IMAGE_QUERY,
+                              db: AsyncSession = Depends(get_async_db)):
+    result = await db.execute(select_product_details().where(Product.id_product == id_product))
+    product = result.unique().scalars().first()
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    if include_image:
+        return await run_in_threadpool(product_details_dto, product, True)
+    return product_details_dto(product, False)
+
+
 
 @router.get("/products/port/{port_id}", response_model=List[ProductRead])
-def get_products_by_port(port_id: int, db: Session = Depends(get_db)):
+async def get_products_by_port(port_id: int, request: Request, response: Response, page: PageParams = Depends(),
+                               include_image: bool = INCLUDE_IMAGE_QUERY, db: AsyncSession = Depends(get_async_db)):
     """
     Get all products for a specific port ID.
     """
     logger.info(f"Getting products for port ID: {port_id}")
-    products = db.query(Product).filter(Product.id_port == port_id).all()
+    cached = catalog_cache.lookup("products", request, cacheable=not include_image)
+    if cached is not None:
+        return cached
+    products, _ = await paginate_async(
+        db, select(Product).where(Product.id_port == port_id), [Product.id_product], page, response
+    )
     if not products:
         logger.warning(f"No products found for port ID: {port_id}")
-    return products
+    products = await with_image_data_async(products, include_image)
+    return catalog_cache.store(
+        "products", request, List[ProductRead], products, response, cacheable=not include_image
+    )
 
 
 @router.post("/products", response_model=ProductRead)
 def create_product(product: ProductCreate, db: Session = Depends(get_db)):
     logger.info(f"Creating new product: {product}")
-    db_product = Product(**product.dict())
+    reference_validator.require(db, (Port.id_port, product.id_port))
+    db_product = Product(**product.dict(exclude={"image"}), image=store_image(product.image))
     db.add(db_product)
     db.commit()
+    catalog_cache.invalidate("products")
     db.refresh(db_product)
     return db_product
 
 @router.get("/products", response_model=List[ProductRead])
-def get_all_products(db: Session = Depends(get_db)):
+async def get_all_products(request: Request, response: Response, page: PageParams = Depends(),
+                           include_image: bool = INCLUDE_IMAGE_QUERY, db: AsyncSession = Depends(get_async_db)):
     logger.info("Getting all products")
-    products = db.query(Product).all()
-    return products
+    cached = catalog_cache.lookup("products", request, cacheable=not include_image)
+    if cached is not None:
+        return cached
+    products, _ = await paginate_async(db, select(Product), [Product.id_product], page, response)
+    products = await with_image_data_async(products, include_image)
+    return catalog_cache.store(
+        "products", request, List[ProductRead], products, response, cacheable=not include_image
+    )
 
 @router.get("/products/exclude", response_model=List[ProductRead])
-def get_all_products(db: Session = Depends(get_db)):
+def get_all_products(response: Response, page: PageParams = Depends(), include_image: bool = INCLUDE_IMAGE_QUERY,
+                     db: Session = Depends(get_read_db)):
     """
     Get all products that are NOT linked to any Order Product.
     """
     logger.info("Getting all products that are NOT linked to any OrderProduct")
-    products = (
+    products, _ = paginate(
         db.query(Product)
         .outerjoin(Order_product, Product.id_product == Order_product.id_product)
-        .filter(Order_product.id_product == None)  # Only products NOT linked to OrderProduct
-        .all()
+        .filter(Order_product.id_product == None),  # Only products NOT linked to OrderProduct
+        [Product.id_product], page, response
     )
     if not products:
         logger.warning("No products found that are not linked to any OrderProduct")
-    return products
+    return with_image_data(products, include_image)
 
 @router.get("/products/{id_product}", response_model=ProductRead)
-def read_product(id_product: int, db: Session = Depends(get_db)):
+async def read_product(id_product: int, include_image: bool = INCLUDE_IMAGE_QUERY,
+                       db: AsyncSession = Depends(get_async_db)):
     logger.info(f"Reading Product with id: {id_product}")
-    db_product = db.query(Product).filter(Product.id_product == id_product).first()
+    db_product = await db.get(Product, id_product)
     if db_product is None:
         logger.error(f"Product with id: {id_product} not found")
         raise HTTPException(status_code=404, detail="Product not found")
-    return db_product
+    return (await with_image_data_async([db_product], include_image))[0]
 
 @router.put("/products/{id_product}", response_model=ProductRead)
 def update_product(id_product: int, product: ProductUpdate, db: Session = Depends(get_db)):
@@ -148,6 +218,7 @@ def update_product(id_product: int, product: ProductUpdate, db: Session = Depend
         logger.error(f"Product with id: {id_product} not found")
         raise HTTPException(status_code=404, detail="/Product not found")
 
+    reference_validator.require(db, (Port.id_port, product.id_port))
     if product.name is not None:
         db_product.name = product.name
     if product.price is not None:
@@ -155,11 +226,12 @@ def update_product(id_product: int, product: ProductUpdate, db: Session = Depend
     if product.weight is not None:
         db_product.weight = product.weight
     if product.image is not None:
-        db_product.image = product.image
+        db_product.image = store_image(product.image)
     if product.id_port is not None:
         db_product.id_port = product.id_port
 
     db.commit()
+    catalog_cache.invalidate("products")
     db.refresh(db_product)
 
     return db_product
@@ -177,24 +249,24 @@ def delete_product(id_product: int, db: Session = Depends(get_db)):
 
     db.delete(db_product)
     db.commit()
+    catalog_cache.invalidate("products")
     return {
         "message": "Product deleted successfully",
         "product": ProductRead.from_orm(db_product)
     }
 
 @router.get("/products/image/{id_product}", response_model=ProductRead)
-def get_image(id_product: int, db: Session = Depends(get_db)):
-    db_product = db.query(Product).filter(Product.id_product == id_product).first()
-    if db_product is None:
+def get_image(id_product: int, request: Request, size: ImageSize = ImageSize.ORIGINAL, db: Session = Depends(get_read_db)):
+    # Only the digest is read, the image itself never passes through Python
+    row = db.query(Product.image).filter(Product.id_product == id_product).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    if db_product.image:
-        try:
-            image_data = base64.b64decode(db_product.image)
-            image_io = BytesIO(image_data)
-            return StreamingResponse(image_io, media_type="image/jpeg")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to decode image for product {id_product}: {e}")
+    image = row.image
+    if image:
+        if not blob_exists(image):
+            raise HTTPException(status_code=500, detail=f"Image {image} for product {id_product} is missing from the blob store")
+        return variant_response(image, size, request)
 
     else:
         missing_filepath = uploads_dir / 'missing.jpg'
@@ -207,14 +279,15 @@ def get_image(id_product: int, db: Session = Depends(get_db)):
 async def upload_image(id_product: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
     try:
         file_content = await file.read()
-        converted_image = base64.b64encode(file_content).decode("utf-8")
+        digest = await run_in_threadpool(save_blob, file_content)
         
         db_product = db.query(Product).filter(Product.id_product == id_product).first()
         if db_product is None:
             raise HTTPException(status_code=404, detail="Product not found")
-        db_product.image = converted_image
+        db_product.image = digest
         db.commit()
-        return {"message": f"Image for product with id {id_product} uploaded and saved successfully in Base64."}
+        catalog_cache.invalidate("products")
+        return {"message": f"Image for product with id {id_product} uploaded and saved successfully.", "image": digest}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to upload image for product {id_product}: {e}")
@@ -1,16 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, File, UploadFile
+from fastapi import APIRouter, HTTPException, Depends, File, UploadFile, Query, Request, Response
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 
 from backend.models import Operation
 from backend.models.ship import Ship, ShipStatus
-from backend.database import get_db
+from backend.database import get_db, get_read_db
 from backend.logging_config import logger
-from pydantic import BaseModel
+from pydantic import BaseModel, computed_field
 from typing import List, Optional
 
-from fastapi.responses import FileResponse, StreamingResponse
-import base64
-from io import BytesIO
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
 import os
 from pathlib import Path
 import datetime
@@ -18,6 +18,13 @@ import datetime
 from .client import get_current_client
 from ..models import UserRole
 from backend.utils.role_validation import check_user_role
+from backend.utils.batch import batch_ids, in_request_order
+from backend.utils.response_cache import catalog_cache
+from backend.utils.serialization import json_response, model_columns
+from backend.utils.pagination import PageParams, paginate
+from backend.utils.references import reference_validator
+from backend.utils.blob_store import blob_exists, inline_image, save_blob, store_image
+from backend.utils.image_variants import ImageSize, variant_response
 router = APIRouter()
 uploads_dir = Path(__file__).resolve().parent.parent / 'uploads'
 
@@ -33,12 +40,21 @@ class ShipUpdate(BaseModel):
     status: Optional[ShipStatus] = None
     image: Optional[str] = None
 
+def ship_image_url(id_ship: int, image: Optional[str]) -> Optional[str]:
+    return f"/api/ships/image/{id_ship}" if image else None
+
 class ShipRead(BaseModel):
     id_ship: int
     name: str
     capacity: int
     status: ShipStatus
-    image: str
+    image: str  # sha256 of the image in the blob store, "" when there is none
+    image_data: Optional[str] = None  # base64 image, only filled in with ?include_image=true
+
+    @computed_field
+    @property
+    def image_url(self) -> Optional[str]:
+        return ship_image_url(self.id_ship, self.image)
 
     class Config:
         from_attributes = True
@@ -58,37 +74,71 @@ class ShipDetailsDTO(BaseModel):
     status: str
     image: Optional[str]
     operations: List[OperationDTO]
+    image_data: Optional[str] = None
+
+    @computed_field
+    @property
+    def image_url(self) -> Optional[str]:
+        return ship_image_url(self.id_ship, self.image)
 
     class Config:
         orm_mode = True
 
-@router.get("/ships/{id_ship}/details", response_model=ShipDetailsDTO)
-def get_ship_details(id_ship: int, db: Session = Depends(get_db)):
-    ship = db.query(Ship).filter(Ship.id_ship == id_ship).first()
-    if not ship:
-        raise HTTPException(status_code=404, detail="Ship not found")
 
-    operations = (
-        db.query(Operation)
-        .filter(Operation.id_ship == id_ship)
-        .all()
-    )
+INCLUDE_IMAGE_QUERY = Query(False, description="Embed the base64 image in the response")
+
+
+def with_image_data(ships, include_image: bool):
+    if not include_image:
+        return ships
+    return [
+        ShipRead.model_validate(ship).model_copy(update={"image_data": inline_image(ship.image)})
+        for ship in ships
+    ]
 
-    return ShipDetailsDTO(
-        id_ship=ship.id_ship,
-        name=ship.name,
-        status=ship.status.value,
-        image=ship.image,
-        operations=[
-            OperationDTO(
-                id_operation=op.id_operation,
-                name_of_operation=op.name_of_operation,
-                operation_type=op.operation_type.value,
-                date_of_operation=op.date_of_operation.isoformat(),
-            )
-            for op in operations
-        ]
+def load_ship_details(db: Session, ship_ids: List[int], include_image: bool) -> List[dict]:
+    """
+    ShipDetailsDTO dicts of the given ships, rendered with json_response(). The ships and their operations
+    come from one statement as plain column rows, no ORM objects are built.
+    """
+    operation_columns = model_columns(OperationDTO, Operation)
+    rows = db.execute(
+        select(Ship.id_ship, Ship.name, Ship.status, Ship.image, *operation_columns)
+        .outerjoin(Operation, Operation.id_ship == Ship.id_ship)
+        .where(Ship.id_ship.in_(ship_ids))
     )
+    keys = list(OperationDTO.model_fields)
+    details = {}
+    for id_ship, name, status, image, *operation in rows:
+        ship = details.get(id_ship)
+        if ship is None:
+            ship = details[id_ship] = {
+                "id_ship": id_ship,
+                "name": name,
+                "status": status,
+                "image": image,
+                "operations": [],
+                "image_data": inline_image(image) if include_image else None,
+                "image_url": ship_image_url(id_ship, image),
+            }
+        # Ships without operations come out of the outer join once, with a NULL operation
+        if operation[0] is not None:
+            ship["operations"].append(dict(zip(keys, operation)))
+    return list(details.values())
+
+@router.get("/ships/details", response_model=List[ShipDetailsDTO])
+def get_ships_details(ids: List[int] = Depends(batch_ids), include_image: bool = INCLUDE_IMAGE_QUERY,
+                      db: Session = Depends(get_read_db)):
+    details = load_ship_details(db, ids, include_image)
+    return json_response(in_request_order(details, ids, lambda ship: ship["id_ship"]))
+
+@router.get("/ships/{id_ship}/details", response_model=ShipDetailsDTO)
+def get_ship_details(id_ship: int, include_image: bool = INCLUDE_IMAGE_QUERY, db: Session = Depends(get_read_db)):
+    details = load_ship_details(db, [id_ship], include_image)
+    if not details:
+        raise HTTPException(status_code=404, detail="Ship not found")
+
+    return json_response(details[0])
 
 
 @router.post("/ships", response_model=ShipRead)  # Response model is ShipRead so there is an id in returned object, this allowed to remove objects from the list without reloading page
@@ -99,26 +149,34 @@ def create_ship(
 ):
     check_user_role(current_client, [UserRole.EMPLOYEE, UserRole.ADMIN])
     logger.info(f"Creating new ship: {ship}")
-    db_ship = Ship(**ship.dict())
+    db_ship = Ship(**ship.dict(exclude={"image"}), image=store_image(ship.image))
     db.add(db_ship)
     db.commit()
+    catalog_cache.invalidate("ships")
     db.refresh(db_ship)
     return db_ship
 
 @router.get("/ships", response_model=List[ShipRead])
-def get_all_ships(db: Session = Depends(get_db)):
+def get_all_ships(request: Request, response: Response, page: PageParams = Depends(),
+                  include_image: bool = INCLUDE_IMAGE_QUERY, db: Session = Depends(get_read_db)):
     logger.info("Getting all ships")
-    ships = db.query(Ship).all()
-    return ships
+    cached = catalog_cache.lookup("ships", request, cacheable=not include_image)
+    if cached is not None:
+        return cached
+    ships, _ = paginate(db.query(Ship), [Ship.id_ship], page, response)
+    return catalog_cache.store(
+        "ships", request, List[ShipRead], with_image_data(ships, include_image), response,
+        cacheable=not include_image,
+    )
 
 @router.get("/ships/{id_ship}", response_model=ShipRead)
-def read_ship(id_ship: int, db: Session = Depends(get_db)):
+def read_ship(id_ship: int, include_image: bool = INCLUDE_IMAGE_QUERY, db: Session = Depends(get_read_db)):
     logger.info(f"Reading Ship with id: {id_ship}")
     db_ship = db.query(Ship).filter(Ship.id_ship == id_ship).first()
     if db_ship is None:
         logger.error(f"Ship with id: {id_ship} not found")
         raise HTTPException(status_code=404, detail="Ship not found")
-    return db_ship
+    return with_image_data([db_ship], include_image)[0]
 
 @router.put("/ships/{id_ship}", response_model=ShipRead)
 def update_ship(id_ship: int, ship: ShipUpdate, db: Session = Depends(get_db)):
@@ -135,9 +193,10 @@ def update_ship(id_ship: int, ship: ShipUpdate, db: Session = Depends(get_db)):
     if ship.status is not None:
         db_ship.status = ship.status
     if ship.image is not None:
-        db_ship.image = ship.image
+        db_ship.image = store_image(ship.image)
 
     db.commit()
+    catalog_cache.invalidate("ships")
     db.refresh(db_ship)
 
     return db_ship
@@ -154,23 +213,24 @@ def delete_ship(id_ship: int, db: Session = Depends(get_db)):
 
     db.delete(db_ship)
     db.commit()
+    catalog_cache.invalidate("ships")
+    reference_validator.forget(Ship.id_ship, id_ship)
     return {"message": "Ship deleted successfully",
             "ship": ShipRead.from_orm(db_ship)
     }
 
 @router.get("/ships/image/{id_ship}", response_model=ShipRead)
-def get_image(id_ship: int, db: Session = Depends(get_db)):
-    db_ship = db.query(Ship).filter(Ship.id_ship == id_ship).first()
-    if db_ship is None:
+def get_image(id_ship: int, request: Request, size: ImageSize = ImageSize.ORIGINAL, db: Session = Depends(get_read_db)):
+    # Only the digest is read, the image itself never passes through Python
+    row = db.query(Ship.image).filter(Ship.id_ship == id_ship).first()
+    if row is None:
         raise HTTPException(status_code=404, detail="Ship not found")
 
-    if db_ship.image:
-        try:
-            image_data = base64.b64decode(db_ship.image)
-            image_io = BytesIO(image_data)
-            return StreamingResponse(image_io, media_type="image/jpeg")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to decode image for ship {id_ship}: {e}")
+    image = row.image
+    if image:
+        if not blob_exists(image):
+            raise HTTPException(status_code=500, detail=f"Image {image} for ship {id_ship} is missing from the blob store")
+        return variant_response(image, size, request)
 
     else:
         missing_filepath = uploads_dir / 'missing.jpg'
@@ -183,14 +243,15 @@ def get_image(id_ship: int, db: Session = Depends(get_db)):
 async def upload_image(id_ship: int, file: UploadFile = File(...), db: Session = Depends(get_db)):
     try:
         file_content = await file.read()
-        converted_image = base64.b64encode(file_content).decode("utf-8")
+        digest = await run_in_threadpool(save_blob, file_content)
         
         db_ship = db.query(Ship).filter(Ship.id_ship == id_ship).first()
         if db_ship is None:
             raise HTTPException(status_code=404, detail="Product not found")
-        db_ship.image = converted_image
+        db_ship.image = digest
         db.commit()
-        return {"message": f"Image for ship with id {id_ship} uploaded and saved successfully in Base64."}
+        catalog_cache.invalidate("ships")
+        return {"message": f"Image for ship with id {id_ship} uploaded and saved successfully.", "image": digest}
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to upload image for ship {id_ship}: {e}")
\ No newline at end of file
@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+import pytest
+
+# The engines, blob store and blocklist refresh are set up when the app is imported, so the test database
+# and directories are configured first. Startup fills the empty database through db_filler.
+_data_dir = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_data_dir}/test.db"
+os.environ.pop("READ_DATABASE_URL", None)
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["BLOB_STORE_DIR"] = os.path.join(_data_dir, "blobs")
+os.environ["IMAGE_VARIANT_CACHE_DIR"] = os.path.join(_data_dir, "variants")
+os.environ["BLOCKLIST_REFRESH_INTERVAL_SECONDS"] = "0"
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from backend.database import engine
+from backend.main import app
+from backend.utils.explain_queries import admin_headers as make_admin_headers, sample_ids as load_sample_ids
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def admin_headers(client):
+    with Session(engine) as session:
+        return make_admin_headers(session)
+
+
+@pytest.fixture(scope="session")
+def sample_ids(client):
+    with Session(engine) as session:
+        return load_sample_ids(session)
@@ -0,0 +1,34 @@
+import io
+import os
+
+from PIL import Image
+from starlette.requests import Request
+
+from backend.utils.blob_store import save_blob
+from backend.utils.image_variants import ImageSize, VARIANT_CACHE_DIR, variant_cache, variant_response
+
+
+def _request():
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+
+def _stored_image() -> str:
+    data = io.BytesIO()
+    Image.new("RGB", (800, 600), "navy").save(data, format="JPEG")
+    return save_blob(data.getvalue())
+
+
+def test_variant_evicted_after_lookup_is_rendered_again(client, monkeypatch):
+    digest = _stored_image()
+    target = VARIANT_CACHE_DIR / f"{digest}-{ImageSize.THUMBNAIL.value}"
+    assert variant_response(digest, ImageSize.THUMBNAIL, _request()).path == target
+
+    # Another request evicts the file between the lookup and the response
+    os.remove(target)
+    monkeypatch.setattr(variant_cache, "get", lambda path: True)
+
+    response = variant_response(digest, ImageSize.THUMBNAIL, _request())
+    assert response.path == target
+    assert response.stat_result.st_size == target.stat().st_size
+    with Image.open(target) as image:
+        assert max(image.size) == 160
@@ -0,0 +1,60 @@
+import base64
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.orm import Session
+
+from backend.database import Base
+from backend.migrations import SchemaVersion, run_migrations
+from backend.models import Client, Product
+from backend.utils.blob_store import blob_exists
+
+
+def _client(number: int, email: str) -> Client:
+    return Client(name="Client", address="Address", email=email, logon_name=f"client{number}", password="x")
+
+
+def _applied(engine) -> set:
+    with Session(engine) as session:
+        return {version for (version,) in session.query(SchemaVersion.version)}
+
+
+def test_unique_client_indexes_wait_for_duplicates_to_be_fixed(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    Base.metadata.create_all(bind=engine)
+    with Session(engine) as session:
+        # A database from before the unique indexes
+        session.execute(text("DROP INDEX ix_client_email"))
+        session.add_all([_client(1, "same@example.com"), _client(2, "same@example.com")])
+        session.commit()
+
+    run_migrations(engine)
+    assert {1, 2, 3, 4} <= _applied(engine)
+    assert 5 not in _applied(engine)
+    with Session(engine) as session:
+        session.query(Client).filter(Client.logon_name == "client2").update({"email": "other@example.com"})
+        session.commit()
+
+    run_migrations(engine)
+    assert 5 in _applied(engine)
+    unique = {index["name"] for index in inspect(engine).get_indexes("client") if index["unique"]}
+    assert {"ix_client_email", "ix_client_logon_name"} <= unique
+
+
+def test_images_that_are_not_base64_are_left_in_place(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    Base.metadata.create_all(bind=engine)
+    valid = base64.b64encode(b"image bytes " * 10).decode()
+    invalid = "not base64 " * 10
+    with Session(engine) as session:
+        session.add_all([
+            Product(name="Broken", price=1, weight=1, image=invalid, id_port=1),
+            Product(name="Valid", price=1, weight=1, image=valid, id_port=1),
+        ])
+        session.commit()
+
+    run_migrations(engine)
+    assert 1 in _applied(engine)
+    with Session(engine) as session:
+        images = dict(session.query(Product.name, Product.image))
+    assert images["Broken"] == invalid
+    assert blob_exists(images["Valid"])
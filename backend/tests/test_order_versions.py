@@ -0,0 +1,51 @@
+from sqlalchemy.orm import Session
+
+from backend.database import engine
+from backend.models.product import Product
+
+
+def _open_order(client, headers, id_product):
+    response = client.post("/api/cart", json={"id_product": id_product, "quantity": 1}, headers=headers)
+    assert response.status_code == 200
+    return response.json()["id_order"], response.headers["ETag"]
+
+
+def _products(count):
+    with Session(engine) as session:
+        return [id_ for (id_,) in session.query(Product.id_product).order_by(Product.id_product).limit(count)]
+
+
+def test_checkout_with_etag_read_before_an_order_product_change_fails(client, admin_headers):
+    first, second = _products(2)
+    id_order, etag = _open_order(client, admin_headers, first)
+    response = client.post(
+        "/api/orders_products", json={"id_order": id_order, "id_product": second, "quantity": 2}, headers=admin_headers
+    )
+    assert response.status_code == 200
+
+    response = client.post(f"/api/checkout/{id_order}", headers={**admin_headers, "If-Match": etag})
+    assert response.status_code == 409
+
+    etag = client.get(f"/api/cart/{id_order}", headers=admin_headers).headers["ETag"]
+    assert client.put(
+        f"/api/orders_products/{id_order}_{second}", json={"quantity": 3}, headers=admin_headers
+    ).status_code == 200
+    response = client.post(f"/api/checkout/{id_order}", headers={**admin_headers, "If-Match": etag})
+    assert response.status_code == 409
+
+    etag = client.get(f"/api/cart/{id_order}", headers=admin_headers).headers["ETag"]
+    assert client.delete(f"/api/orders_products/{id_order}_{second}", headers=admin_headers).status_code == 200
+    response = client.post(f"/api/checkout/{id_order}", headers={**admin_headers, "If-Match": etag})
+    assert response.status_code == 409
+
+
+def test_order_products_of_a_shipped_order_cannot_change(client, admin_headers):
+    first, second = _products(2)
+    id_order, etag = _open_order(client, admin_headers, first)
+    assert client.post(f"/api/checkout/{id_order}", headers={**admin_headers, "If-Match": etag}).status_code == 200
+
+    response = client.post(
+        "/api/orders_products", json={"id_order": id_order, "id_product": second, "quantity": 1}, headers=admin_headers
+    )
+    assert response.status_code == 400
+    assert client.delete(f"/api/orders_products/{id_order}_{first}", headers=admin_headers).status_code == 400
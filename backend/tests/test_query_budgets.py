@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from backend.database import engine
+from backend.utils.explain_queries import PATH_ID_COLUMNS, fill_path
+from backend.utils.query_budget import BATCH_QUERY_BUDGETS, BATCH_SAMPLE_SIZE, DETAILS_QUERY_BUDGETS, assert_max_queries
+
+
+@pytest.mark.parametrize("path,budget", DETAILS_QUERY_BUDGETS.items())
+def test_details_route_stays_within_budget(client, admin_headers, sample_ids, path, budget):
+    url = fill_path(path, sample_ids)
+    # The first call caches the principal, only the statements of the route itself are counted
+    client.get(url, headers=admin_headers)
+    response = assert_max_queries(client, url, budget, headers=admin_headers)
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize("path,table_budget", BATCH_QUERY_BUDGETS.items())
+def test_batch_details_route_stays_within_budget(client, admin_headers, path, table_budget):
+    # The budget does not depend on the number of ids
+    name, budget = table_budget
+    with Session(engine) as session:
+        ids = [id_ for (id_,) in session.query(PATH_ID_COLUMNS[name]).limit(BATCH_SAMPLE_SIZE)]
+    url = f"{path}?ids={','.join(map(str, ids))}"
+    client.get(url, headers=admin_headers)
+    response = assert_max_queries(client, url, budget, headers=admin_headers)
+    assert response.status_code == 200
+    assert len(response.json()) == len(ids) > 1
+
+
+def test_assert_max_queries_reports_the_statements(client, admin_headers, sample_ids):
+    url = fill_path("/api/ports/{id_port}/details", sample_ids)
+    client.get(url, headers=admin_headers)
+    with pytest.raises(AssertionError, match="more than 1") as error:
+        assert_max_queries(client, url, 1, headers=admin_headers)
+    assert "SELECT" in str(error.value)
+
+
+def test_operation_read_is_one_statement(client, admin_headers, sample_ids):
+    url = fill_path("/api/operations/{id_operation}", sample_ids)
+    client.get(url, headers=admin_headers)
+    response = assert_max_queries(client, url, 1, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.json()["id_operation"] == sample_ids["operation"]
@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+from fastapi import Depends
+from sqlalchemy.orm import Session
+
+from backend.database import get_db
+from backend.main import app
+from backend.models import Ship
+from backend.utils.explain_queries import fill_path
+from backend.utils.query_tracking import N_PLUS_ONE_THRESHOLD, statement_shape
+
+N_PLUS_ONE_PATH = "/test/n-plus-one"
+
+
+def load_ships_one_by_one(db: Session = Depends(get_db)):
+    # One SELECT per ship after the one listing their ids, the pattern the warning is meant to catch
+    ids = [id_ship for (id_ship,) in db.query(Ship.id_ship).limit(N_PLUS_ONE_THRESHOLD + 1)]
+    return [db.get(Ship, id_ship).name for id_ship in ids]
+
+
+@pytest.fixture(scope="module")
+def n_plus_one_route():
+    app.add_api_route(N_PLUS_ONE_PATH, load_ships_one_by_one)
+    yield N_PLUS_ONE_PATH
+    app.router.routes[:] = [route for route in app.router.routes if getattr(route, "path", None) != N_PLUS_ONE_PATH]
+
+
+def n_plus_one_warnings(caplog) -> list:
+    return [record.getMessage() for record in caplog.records
+            if record.levelno == logging.WARNING and "Possible N+1" in record.getMessage()]
+
+
+def test_repeated_statement_in_one_request_is_reported(client, n_plus_one_route, caplog):
+    with caplog.at_level(logging.WARNING):
+        response = client.get(n_plus_one_route)
+    assert response.status_code == 200
+    warnings = n_plus_one_warnings(caplog)
+    assert len(warnings) == 1
+    assert f"GET {n_plus_one_route}" in warnings[0]
+    assert f"ran {N_PLUS_ONE_THRESHOLD + 1} times" in warnings[0]
+    assert "FROM ship" in warnings[0]
+
+
+def test_clean_details_route_is_not_reported(client, admin_headers, sample_ids, caplog):
+    url = fill_path("/api/ships/{id_ship}/details", sample_ids)
+    client.get(url, headers=admin_headers)
+    with caplog.at_level(logging.WARNING):
+        response = client.get(url, headers=admin_headers)
+    assert response.status_code == 200
+    assert n_plus_one_warnings(caplog) == []
+
+
+def test_server_timing_counts_the_request_statements(client, n_plus_one_route):
+    response = client.get(n_plus_one_route)
+    assert response.headers["server-timing"].startswith("db;dur=")
+    assert f'desc="{N_PLUS_ONE_THRESHOLD + 2} queries"' in response.headers["server-timing"]
+
+
+def test_statement_shape_folds_in_lists_and_whitespace():
+    assert statement_shape("SELECT a\n  FROM t WHERE id IN (?, ?, ?) AND x = ?") == \
+        statement_shape("SELECT a FROM t WHERE id IN (?) AND x = ?")
+    assert statement_shape("SELECT a FROM t WHERE x = ?") != statement_shape("SELECT b FROM t WHERE x = ?")
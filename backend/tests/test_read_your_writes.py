@@ -0,0 +1,14 @@
+from backend.database import recent_writers
+
+
+def test_rejected_write_does_not_pin_reads_to_the_primary(client):
+    authorization = "Bearer rejected-write"
+    response = client.post("/api/cart", json={"quantity": 1}, headers={"Authorization": authorization})
+    assert response.status_code >= 400
+    assert recent_writers.get(("auth", authorization)) is None
+
+
+def test_committed_write_pins_reads_to_the_primary(client, admin_headers, sample_ids):
+    response = client.post("/api/cart", json={"id_product": sample_ids["product"], "quantity": 1}, headers=admin_headers)
+    assert response.status_code == 200
+    assert recent_writers.get(("auth", admin_headers["Authorization"]))
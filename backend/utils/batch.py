@@ -0,0 +1,29 @@
+from typing import Callable, Iterable, List
+
+from fastapi import HTTPException, Query
+
+MAX_BATCH_IDS = 500  # keeps the IN lists below SQLite's bound parameter limit
+
+
+def batch_ids(
+    ids: List[str] = Query(..., description="Ids to fetch, comma separated (ids=1,2,3) or repeated (ids=1&ids=2)"),
+) -> List[int]:
+    """Requested ids in request order, without duplicates."""
+    parsed = []
+    try:
+        for value in ids:
+            parsed.extend(int(part) for part in value.split(",") if part.strip())
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma separated list of integers")
+    parsed = list(dict.fromkeys(parsed))
+    if not parsed:
+        raise HTTPException(status_code=400, detail="No ids given")
+    if len(parsed) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids can be fetched at once")
+    return parsed
+
+
+def in_request_order(items: Iterable, ids: List[int], key: Callable) -> list:
+    # Ids that do not exist are left out
+    by_id = {key(item): item for item in items}
+    return [by_id[id_] for id_ in ids if id_ in by_id]
@@ -0,0 +1,102 @@
+"""
+Measure the concurrent-request throughput of the hot read routes.
+
+    python -m backend.utils.benchmark_reads [--concurrency 64] [--requests 1000] [--threads 40]
+
+Requests are sent in-process through httpx's ASGI transport, so sync routes are served from the same
+threadpool as under uvicorn (40 threads unless --threads says otherwise) and async routes run on the
+event loop. Every endpoint gets a warm-up round, then `--requests` calls with `--concurrency` of them in
+flight at once. Run it on two commits to compare them: the script only relies on the app and the database.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import anyio.to_thread
+import httpx
+from sqlalchemy.orm import Session
+
+from backend.database import engine
+
+# Read routes on the hot path of the frontend; lists are fetched a full default page at a time
+BENCHMARK_PATHS = [
+    "/api/orders",
+    "/api/orders/{order_id}",
+    "/api/operations",
+    "/api/operations/{id_operation}/details",
+    "/api/products",
+    "/api/products/{id_product}/details",
+]
+
+
+def _percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def _measure(client: httpx.AsyncClient, url: str, headers: dict, requests: int, concurrency: int) -> dict:
+    latencies = []
+    failures = 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal failures
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await client.get(url, headers=headers)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "throughput": requests / elapsed,
+        "p50": _percentile(latencies, 0.5) * 1000,
+        "p95": _percentile(latencies, 0.95) * 1000,
+        "failures": failures,
+    }
+
+
+async def run(requests: int, concurrency: int, threads: int) -> int:
+    from backend.main import app
+    from backend.utils.explain_queries import admin_headers, fill_path, sample_ids
+
+    with Session(engine) as session:
+        ids = sample_ids(session)
+        headers = admin_headers(session)
+    if headers is None:
+        print("No admin client in the database, start the server once to create the default users")
+        return 1
+
+    if threads:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = threads
+    print(f"{requests} requests per endpoint, {concurrency} concurrent, "
+          f"{anyio.to_thread.current_default_thread_limiter().total_tokens} threadpool slots")
+
+    # The lifespan runs the startup and shutdown handlers, the latter closes the database connections
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for path in BENCHMARK_PATHS:
+                url = fill_path(path, ids)
+                await _measure(client, url, headers, min(requests, 100), concurrency)
+                result = await _measure(client, url, headers, requests, concurrency)
+                print(f"GET {path}: {result['throughput']:.0f} req/s, p50 {result['p50']:.1f} ms, "
+                      f"p95 {result['p95']:.1f} ms, {result['failures']} failed")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=0, help="threadpool size for sync routes, 0 keeps the default")
+    args = parser.parse_args()
+    return asyncio.run(run(args.requests, args.concurrency, args.threads))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Compare the cost of producing large list and details payloads through the response_model (ORM objects or DTO
+instances validated one by one, then FastAPI's JSON encoding) and through the fast path of
+backend.utils.serialization (plain column rows or dicts rendered with orjson).
+
+    python -m backend.utils.benchmark_serialization [--rows 5000] [--repeat 10]
+
+Runs on a throwaway in-memory SQLite database filled with `--rows` operations, orders and products, checks that
+both paths produce the same bytes and prints the median time of each.
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, joinedload
+
+from backend.database import Base
+from backend.models import Client, Operation, Order_product, Port, Product, Ship
+from backend.models.operation import OperationType
+from backend.models.order import Order, OrderStatus
+from backend.routes.client import ClientRead
+from backend.routes.operation import OperationRead, select_operation_rows
+from backend.routes.order import OrderRead, query_orders, select_order_rows
+from backend.routes.ship import OperationDTO, ShipDetailsDTO, load_ship_details
+from backend.utils.serialization import json_response, model_columns, row_dicts
+
+
+def seed(session: Session, rows: int):
+    port = Port(name="Benchmark", location="Gdynia", country="PL")
+    ship = Ship(name="Benchmark", capacity=1000, image="")
+    session.add_all([port, ship])
+    session.flush()
+    clients = [
+        Client(name=f"Client {i}", address="ul. Testowa 1", email=f"client{i}@example.com", logon_name=f"client{i}",
+               password="x")
+        for i in range(rows // 10 or 1)
+    ]
+    session.add_all(clients)
+    session.flush()
+    start = datetime(2024, 1, 1, 8, 30, 15, 123456)
+    orders = [
+        Order(status=OrderStatus.PENDING, date_of_order=start + timedelta(hours=i), description=f"Order {i}",
+              id_port=port.id_port, id_client=clients[i % len(clients)].id_client)
+        for i in range(rows)
+    ]
+    products = [
+        Product(name=f"Product {i}", price=10.5 + i, weight=2.25 * (i % 7 + 1), image="", id_port=port.id_port)
+        for i in range(rows)
+    ]
+    session.add_all(orders + products)
+    session.flush()
+    session.add_all(
+        Order_product(id_order=order.id_order, id_product=product.id_product, quantity=i % 5 + 1)
+        for i, (order, product) in enumerate(zip(orders, products))
+    )
+    session.add_all(
+        Operation(name_of_operation=f"Operation {i}", operation_type=list(OperationType)[i % len(OperationType)],
+                  date_of_operation=start + timedelta(minutes=i), id_ship=ship.id_ship, id_port=port.id_port,
+                  id_order=orders[i].id_order)
+        for i in range(rows)
+    )
+    session.commit()
+    return ship.id_ship
+
+
+def through_response_model(response_model, content) -> bytes:
+    # What FastAPI does with a route's return value: validate it as the response_model, encode it, json.dumps
+    field = create_model_field(name="Response", type_=response_model, mode="serialization")
+    encoded = asyncio.run(serialize_response(field=field, response_content=content, is_coroutine=True))
+    return JSONResponse(encoded).body
+
+
+def legacy_ship_details(ship: Ship) -> ShipDetailsDTO:
+    # The details builder before the fast path, one DTO per operation
+    return ShipDetailsDTO(
+        id_ship=ship.id_ship,
+        name=ship.name,
+        status=ship.status.value,
+        image=ship.image,
+        operations=[
+            OperationDTO(
+                id_operation=op.id_operation,
+                name_of_operation=op.name_of_operation,
+                operation_type=op.operation_type.value,
+                date_of_operation=op.date_of_operation.isoformat(),
+            )
+            for op in ship.operations
+        ],
+    )
+
+
+def cases(session: Session, id_ship: int, rows: int) -> dict:
+    def fresh():
+        # Every run loads its objects again, like a request with a new session would
+        session.expunge_all()
+        return session
+
+    def ship():
+        # Loaded like the details routes did before the fast path
+        return fresh().query(Ship).options(joinedload(Ship.operations)).filter(Ship.id_ship == id_ship).first()
+
+    return {
+        "operations list": (
+            lambda: through_response_model(List[OperationRead], fresh().query(Operation).limit(rows).all()),
+            lambda: json_response(row_dicts(fresh().execute(select_operation_rows().limit(rows)).all())).body,
+        ),
+        "orders list": (
+            lambda: through_response_model(List[OrderRead], query_orders(fresh()).limit(rows).all()),
+            lambda: json_response(row_dicts(fresh().execute(select_order_rows().limit(rows)).all())).body,
+        ),
+        "clients list": (
+            lambda: through_response_model(List[ClientRead], fresh().query(Client).all()),
+            lambda: json_response(row_dicts(fresh().query(*model_columns(ClientRead, Client)).all())).body,
+        ),
+        "ship details": (
+            lambda: through_response_model(ShipDetailsDTO, legacy_ship_details(ship())),
+            lambda: json_response(load_ship_details(fresh(), [id_ship], False)[0]).body,
+        ),
+    }
+
+
+def median_ms(produce, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        produce()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    mismatches = 0
+    with Session(engine) as session:
+        id_ship = seed(session, args.rows)
+        print(f"{args.rows} rows, median of {args.repeat} runs")
+        for name, (slow, fast) in cases(session, id_ship, args.rows).items():
+            if slow() != fast():
+                mismatches += 1
+                print(f"{name}: payloads differ")
+                continue
+            slow_ms, fast_ms = median_ms(slow, args.repeat), median_ms(fast, args.repeat)
+            print(f"{name}: response_model {slow_ms:.1f} ms, fast path {fast_ms:.1f} ms, {slow_ms / fast_ms:.1f}x")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse
+
+load_dotenv()
+uploads_dir = Path(__file__).resolve().parent.parent / 'uploads'
+BLOB_STORE_DIR = Path(os.getenv("BLOB_STORE_DIR", uploads_dir / 'blobs'))
+IMAGE_CACHE_CONTROL = "no-cache"  # URLs are per entity, so clients revalidate with the ETag instead
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+]
+
+
+def is_digest(value: Optional[str]) -> bool:
+    return bool(value) and _DIGEST_RE.match(value) is not None
+
+
+def blob_path(digest: str) -> Path:
+    # Two-level fan-out keeps directories small once there are many thousands of images
+    return BLOB_STORE_DIR / digest[:2] / digest
+
+
+def blob_exists(digest: str) -> bool:
+    return is_digest(digest) and blob_path(digest).is_file()
+
+
+def save_blob(data: bytes) -> str:
+    """
+    Store `data` under its sha256 and return the hex digest. Identical content is written only once.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = blob_path(digest)
+    if path.is_file():
+        return digest
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temp file in the same directory and rename, so readers never see a partial blob
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest
+
+
+def store_image(value: str) -> str:
+    """
+    Turn the `image` value sent by the API clients into what is kept in the row: base64 content is
+    moved to the store and replaced by its digest, an existing digest or "" (no image) is kept as is.
+    """
+    if not value or blob_exists(value):
+        return value
+    if is_digest(value):
+        raise HTTPException(status_code=400, detail=f"Unknown image digest: {value}")
+    try:
+        data = base64.b64decode(value, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Image must be base64 encoded")
+    return save_blob(data)
+
+
+def inline_image(digest: Optional[str]) -> Optional[str]:
+    # Only for clients that explicitly ask for the image inside the JSON payload
+    if not blob_exists(digest):
+        return None
+    return base64.b64encode(blob_path(digest).read_bytes()).decode("utf-8")
+
+
+def guess_media_type(path: Path) -> str:
+    with open(path, "rb") as blob_file:
+        header = blob_file.read(12)
+    for signature, media_type in _SIGNATURES:
+        if header.startswith(signature):
+            return media_type
+    return "application/octet-stream"
+
+
+def file_response(path: Path, etag: str, request: Request, stat_result: Optional[os.stat_result] = None) -> Response:
+    """
+    Serve a file straight from disk (sendfile, Range requests handled by FileResponse) with the given
+    strong ETag, answering 304 when the client already has it. A `stat_result` taken by the caller is
+    reused instead of FileResponse stating the file again when it starts sending.
+    """
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, media_type=guess_media_type(path), headers=headers, stat_result=stat_result)
+
+
+def blob_response(digest: str, request: Request) -> Response:
+    # The content hash is a natural strong ETag
+    return file_response(blob_path(digest), f'"{digest}"', request)
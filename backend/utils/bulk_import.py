@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from backend.logging_config import logger
+from backend.utils.references import reference_validator
+
+load_dotenv()
+# Rows per executemany; also the size of the IN lists of the lookups, below SQLite's bound parameter limit
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 500))
+
+# A parsed record, or the reason the line could not be parsed, with its line number in the upload
+Record = Tuple[int, Union[dict, str]]
+
+
+class RowError(BaseModel):
+    row: int  # line number in the uploaded file
+    errors: List[str]
+
+
+class BulkImportResult(BaseModel):
+    received: int
+    inserted: int
+    errors: List[RowError]
+
+
+def chunks(items: list, size: int = IMPORT_CHUNK_SIZE) -> Iterator[list]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def parse_records(body: bytes, content_type: str) -> Iterator[Record]:
+    """Records of an NDJSON upload, or of a CSV one with a header line when the content type is text/csv."""
+    try:
+        text = body.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Upload must be UTF-8 encoded")
+
+    if content_type.startswith("text/csv"):
+        reader = csv.DictReader(io.StringIO(text))
+        for row in reader:
+            # Empty cells are missing values, extra cells without a header (key None) are dropped
+            yield reader.line_num, {key: value if value != "" else None for key, value in row.items() if key is not None}
+        return
+
+    for number, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield number, f"invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield number, "expected a JSON object"
+            continue
+        yield number, record
+
+
+def import_rows(
+    db: Session,
+    model,
+    schema,
+    records: Iterable[Record],
+    foreign_keys: Dict[str, object],
+    find_duplicates: Optional[Callable[[Session, List[Tuple[int, dict]]], List[int]]] = None,
+    prepare: Optional[Callable[[BaseModel], dict]] = None,
+) -> BulkImportResult:
+    """
+    Validate every record against `schema`, check the `foreign_keys` (field -> referenced column) of all rows
+    together with the reference validator, drop the rows `find_duplicates` reports and insert the rest with
+    executemany in chunks of IMPORT_CHUNK_SIZE, in a single transaction. Rows with errors are skipped and
+    reported by line number.
+    """
+    errors: Dict[int, List[str]] = {}
+    valid = []
+    received = 0
+    for number, record in records:
+        received += 1
+        if isinstance(record, str):
+            errors[number] = [record]
+            continue
+        try:
+            item = schema.model_validate(record)
+        except ValidationError as e:
+            errors[number] = [f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors()]
+            continue
+        valid.append((number, prepare(item) if prepare else item.model_dump()))
+
+    missing = reference_validator.find_missing(
+        db, [(column, {values[field] for _, values in valid}) for field, column in foreign_keys.items()]
+    )
+    for (field, column), missing_ids in zip(foreign_keys.items(), missing):
+        for number, values in valid:
+            if values[field] in missing_ids:
+                errors.setdefault(number, []).append(f"{field}: {column.class_.__name__} {values[field]} not found")
+
+    if find_duplicates:
+        for number in find_duplicates(db, [(number, values) for number, values in valid if number not in errors]):
+            errors.setdefault(number, []).append(f"duplicate {model.__name__.lower()}")
+
+    rows = [values for number, values in valid if number not in errors]
+    for chunk in chunks(rows):
+        db.execute(insert(model), chunk)
+    db.commit()
+
+    logger.info(f"Bulk import of {model.__name__}: {received} received, {len(rows)} inserted, {len(errors)} rejected")
+    return BulkImportResult(
+        received=received,
+        inserted=len(rows),
+        errors=[RowError(row=number, errors=messages) for number, messages in sorted(errors.items())],
+    )
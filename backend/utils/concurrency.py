@@ -0,0 +1,51 @@
+from typing import Optional
+
+from fastapi import Header, HTTPException, Response
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
+
+from backend.logging_config import logger
+
+# Rows with a `version` column (orders, cart lines) are updated optimistically: the ORM adds
+# "AND version = <version read>" to the UPDATE and bumps it, so a concurrent change makes the write fail
+# instead of being overwritten. Clients see the version as the ETag and can send it back in If-Match.
+
+
+def version_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def set_version_etag(response: Response, version: int):
+    response.headers["ETag"] = version_etag(version)
+
+
+def if_match_version(if_match: Optional[str] = Header(None)) -> Optional[int]:
+    """The version the client expects from an If-Match header, None when it sent none (or *)."""
+    if if_match is None or if_match.strip() == "*":
+        return None
+    tag = if_match.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    try:
+        return int(tag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="If-Match must be an ETag returned by this API")
+
+
+def check_version(name: str, current: int, expected: Optional[int]):
+    if expected is not None and current != expected:
+        logger.warning(f"{name} is at version {current}, the request expected version {expected}")
+        raise HTTPException(
+            status_code=409,
+            detail=f"{name} was changed by another request (version {current}), reload it and retry",
+        )
+
+
+def commit_versioned(db: Session, name: str):
+    # The row changed between our read and our UPDATE
+    try:
+        db.commit()
+    except StaleDataError:
+        db.rollback()
+        logger.warning(f"Concurrent update of {name} detected")
+        raise HTTPException(status_code=409, detail=f"{name} was changed by another request, reload it and retry")
@@ -0,0 +1,39 @@
+from typing import Iterable
+
+from sqlalchemy.orm import Session
+
+from backend.database import engine
+from backend.logging_config import logger
+from backend.models.debl.email_block_list import email_block_list
+
+
+class DomainBlocklist:
+    """
+    In-memory copy of the email_block_list table so registration never queries it.
+    A reload builds a new frozenset and swaps the reference, readers never see a half-loaded set.
+    """
+
+    def __init__(self):
+        self._domains = frozenset()
+        self.version = 0
+
+    def __len__(self):
+        return len(self._domains)
+
+    def load(self, domains: Iterable[str]):
+        self._domains = frozenset(domain.strip().lower().rstrip('.') for domain in domains if domain.strip())
+        self.version += 1
+        logger.info(f"Email domain blocklist loaded with {len(self._domains)} domains (version {self.version})")
+
+    def load_from_db(self):
+        with Session(engine) as session:
+            self.load(domain for (domain,) in session.query(email_block_list.domain))
+
+    def is_blocked(self, domain: str) -> bool:
+        # A listed domain also blocks its subdomains: a.b.example.com matches a.b.example.com, b.example.com, example.com
+        domains = self._domains
+        labels = domain.lower().rstrip('.').split('.')
+        return any('.'.join(labels[i:]) in domains for i in range(len(labels) - 1))
+
+
+domain_blocklist = DomainBlocklist()
@@ -0,0 +1,117 @@
+"""
+Print the query plan of every statement the GET routes run, to check that each one uses an index.
+
+    python -m backend.utils.explain_queries
+
+Every GET route is called once through a TestClient as an admin, with path ids taken from the first row
+of the matching table. Statements are captured with an engine event and explained against the same database.
+"""
+import re
+import sys
+from typing import Optional
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.database import engine, engines
+from backend.main import app
+from backend.models import Client, Operation, Port, Product, Ship, UserRole
+from backend.models.order import Order
+from backend.routes.client import create_access_token
+
+# Path parameter name -> column its sample value is read from
+PATH_ID_COLUMNS = {
+    "port": Port.id_port,
+    "ship": Ship.id_ship,
+    "product": Product.id_product,
+    "order": Order.id_order,
+    "client": Client.id_client,
+    "operation": Operation.id_operation,
+}
+
+
+def _is_full_scan(plan_line: str) -> bool:
+    # SQLite reports "SCAN <table>" for a full scan and "SEARCH ... USING INDEX" / "SCAN ... USING INDEX" otherwise.
+    # List pages show up as a scan too, they walk the rowid in key order and stop at the LIMIT.
+    # Scans of a subquery (anon_1, (subquery-1)) only read the rows the subquery already limited.
+    if not plan_line.startswith("SCAN ") or " USING " in plan_line:
+        return False
+    return not plan_line[len("SCAN "):].startswith(("anon_", "(subquery"))
+
+
+def sample_ids(session: Session) -> dict:
+    return {name: session.query(column).order_by(column).limit(1).scalar() for name, column in PATH_ID_COLUMNS.items()}
+
+
+def admin_headers(session: Session) -> Optional[dict]:
+    admin = session.query(Client).filter(Client.role == UserRole.ADMIN).first()
+    if admin is None:
+        return None
+    return {"Authorization": f"Bearer {create_access_token({'sub': str(admin.id_client)})}"}
+
+
+def fill_path(path: str, ids: dict) -> str:
+    def replace(match):
+        name = match.group(1).replace("id_", "").replace("_id", "")
+        return str(ids.get(name) or 1)
+    return re.sub(r"{(\w+)}", replace, path)
+
+
+def _explain(connection, statement: str, parameters):
+    if engine.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN {statement}", parameters).fetchall()
+    return [row[0] for row in rows]
+
+
+def main() -> int:
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, parameters))
+
+    with Session(engine) as session:
+        ids = sample_ids(session)
+        headers = admin_headers(session)
+    if headers is None:
+        print("No admin client in the database, start the server once to create the default users")
+        return 1
+
+    full_scans = 0
+    # Async routes run their statements on the async engines, explained here through the sync one
+    binds = tuple(getattr(bind, "sync_engine", bind) for bind in engines)
+    for bind in binds:
+        event.listen(bind, "before_cursor_execute", capture)
+    try:
+        # Entering the client runs the app lifespan, whose shutdown closes the async engine's connections
+        with TestClient(app) as client:
+            for route in app.routes:
+                if not isinstance(route, APIRoute) or "GET" not in route.methods or not route.path.startswith("/api"):
+                    continue
+                captured.clear()
+                client.get(fill_path(route.path, ids), headers=headers)
+                # The same statement shape is explained once, with the parameters of its first execution
+                statements = list({statement: parameters for statement, parameters in reversed(captured)}.items())[::-1]
+                print(f"\n=== GET {route.path} ({len(statements)} statements)")
+                with engine.connect() as connection:
+                    for statement, parameters in statements:
+                        plan = _explain(connection, statement, parameters)
+                        scans = [line for line in plan if _is_full_scan(line)]
+                        full_scans += len(scans)
+                        print(f"  {' '.join(statement.split())}")
+                        for line in plan:
+                            print(f"    {'!! ' if line in scans else ''}{line}")
+    finally:
+        for bind in binds:
+            event.remove(bind, "before_cursor_execute", capture)
+
+    print(f"\n{full_scans} full table scans")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
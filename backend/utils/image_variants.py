@@ -0,0 +1,144 @@
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from enum import Enum
+from pathlib import Path
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from PIL import Image
+
+from backend.logging_config import logger
+from backend.utils.blob_store import blob_path, blob_response, file_response, uploads_dir
+
+load_dotenv()
+VARIANT_CACHE_DIR = Path(os.getenv("IMAGE_VARIANT_CACHE_DIR", uploads_dir / 'variants'))
+VARIANT_CACHE_MAX_BYTES = int(os.getenv("IMAGE_VARIANT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+class ImageSize(str, Enum):
+    ORIGINAL = "original"
+    THUMBNAIL = "thumbnail"
+    CARD = "card"
+    FULL = "full"
+
+
+# Longest edge in pixels, twice the size the frontend displays them at so they stay sharp on HiDPI screens
+VARIANT_EDGES = {
+    ImageSize.THUMBNAIL: 160,
+    ImageSize.CARD: 400,
+    ImageSize.FULL: 1280,
+}
+
+
+class VariantCache:
+    """
+    Size-capped LRU of generated variants on disk. Recency is kept in memory and mirrored in the files'
+    mtime, so a restarted worker picks up the existing files in the right eviction order.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = None  # OrderedDict path -> size, oldest first, loaded on first use
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = [(path, path.stat()) for path in self.directory.iterdir() if path.is_file() and not path.name.startswith(".tmp-")]
+        files.sort(key=lambda entry: entry[1].st_mtime)
+        self._entries = OrderedDict((path, stat.st_size) for path, stat in files)
+        self._total_bytes = sum(self._entries.values())
+
+    def get(self, path: Path) -> bool:
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if path not in self._entries:
+                return False
+            self._entries.move_to_end(path)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(path, 0)
+            return False
+        return True
+
+    def put(self, path: Path, size: int):
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            self._total_bytes -= self._entries.pop(path, 0)
+            self._entries[path] = size
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted, evicted_size = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                try:
+                    os.remove(evicted)
+                except FileNotFoundError:
+                    pass
+
+
+variant_cache = VariantCache(VARIANT_CACHE_DIR, VARIANT_CACHE_MAX_BYTES)
+
+
+def _render_variant(source: Path, target: Path, edge: int) -> bool:
+    """
+    Write a downscaled copy of `source` to `target`. Returns False when the original already fits,
+    in which case the original is served as is.
+    """
+    with Image.open(source) as image:
+        if max(image.size) <= edge:
+            return False
+        # For JPEG this makes the decoder skip DCT scales we do not need, which is most of the decode cost
+        image.draft("RGB", (edge, edge))
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        has_alpha = image.mode in ("RGBA", "LA", "P")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as tmp_file:
+                if has_alpha:
+                    image.save(tmp_file, format="PNG", optimize=True)
+                else:
+                    image.convert("RGB").save(tmp_file, format="JPEG", quality=85, optimize=True, progressive=True)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return True
+
+
+def variant_response(digest: str, size: ImageSize, request: Request) -> Response:
+    """
+    Serve the `size` variant of a stored image, rendering it on first request.
+    """
+    if size == ImageSize.ORIGINAL:
+        return blob_response(digest, request)
+
+    target = VARIANT_CACHE_DIR / f"{digest}-{size.value}"
+    etag = f'"{digest}-{size.value}"'
+    if variant_cache.get(target):
+        try:
+            return file_response(target, etag, request, target.stat())
+        except FileNotFoundError:
+            # Evicted by another request since the lookup, rendered again below
+            logger.info(f"Cached {size.value} variant of image {digest} is gone, rendering it again")
+
+    try:
+        rendered = _render_variant(blob_path(digest), target, VARIANT_EDGES[size])
+    except (OSError, Image.DecompressionBombError) as e:
+        # Not something Pillow can read, fall back to the original bytes
+        logger.warning(f"Could not render {size.value} variant of image {digest}: {e}")
+        return blob_response(digest, request)
+    if not rendered:
+        return blob_response(digest, request)
+
+    stat_result = target.stat()
+    variant_cache.put(target, stat_result.st_size)
+    return file_response(target, etag, request, stat_result)
@@ -0,0 +1,165 @@
+"""
+Prometheus metrics of the API, served on /metrics: per-route request counts, latency, response sizes and
+database statements, requests in flight, connection pool waits and state, and row counts per table.
+Everything is recorded by one ASGI middleware and engine events; the pool state and row counts are only
+read when Prometheus scrapes.
+"""
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, ProcessCollector
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event, func, select
+
+from backend.utils.query_tracking import add_server_timing, track_queries, warn_repeated
+
+load_dotenv()
+# Row counts are a COUNT(*) per table, re-run at most this often however often Prometheus scrapes
+METRICS_ROW_COUNT_INTERVAL_SECONDS = float(os.getenv("METRICS_ROW_COUNT_INTERVAL_SECONDS", 60))
+
+registry = CollectorRegistry()
+ProcessCollector(registry=registry)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route template and status", ["method", "route", "status"],
+    registry=registry,
+)
+REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Time from receiving the request to sending the last body chunk",
+    ["method", "route"], registry=registry,
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+RESPONSE_SIZE = Histogram(
+    "http_response_size_bytes", "Response body size, compressed if it was", ["method", "route"], registry=registry,
+    buckets=(100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000),
+)
+# The route is only known once the router has matched the request, requests in flight are counted per method
+IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being served", ["method"], registry=registry)
+REQUEST_QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements run while serving one request", ["method", "route"],
+    registry=registry, buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 500),
+)
+DB_QUERIES = Counter("db_queries_total", "SQL statements by engine", ["engine"], registry=registry)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent getting a connection from the pool", ["engine"], registry=registry,
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+
+def observe_pool_wait(engine_name: str, seconds: float):
+    DB_POOL_WAIT.labels(engine_name).observe(seconds)
+
+
+def instrument_engine(bind, name: str):
+    """Count the statements of `bind` (sync or async engine) per engine."""
+    queries = DB_QUERIES.labels(name)
+    _pool_state.engines[name] = bind
+
+    @event.listens_for(getattr(bind, "sync_engine", bind), "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        queries.inc()
+
+
+class PoolStateCollector:
+    # Read from the pools at scrape time, nothing is recorded on checkout or checkin
+    def __init__(self):
+        self.engines = {}
+
+    def collect(self):
+        checked_out = GaugeMetricFamily("db_pool_checked_out", "Connections in use", labels=["engine"])
+        idle = GaugeMetricFamily("db_pool_idle", "Open connections waiting in the pool", labels=["engine"])
+        overflow = GaugeMetricFamily("db_pool_overflow", "Connections open beyond pool_size", labels=["engine"])
+        for name, bind in self.engines.items():
+            pool = bind.pool
+            # Only queue pools keep these counts, e.g. the single connection of in-memory SQLite does not
+            if not hasattr(pool, "checkedout"):
+                continue
+            checked_out.add_metric([name], pool.checkedout())
+            idle.add_metric([name], pool.checkedin())
+            overflow.add_metric([name], max(pool.overflow(), 0))
+        yield from (checked_out, idle, overflow)
+
+
+class TableRowCounts:
+    """Rows per table, counted on `bind` at most every `interval` seconds."""
+
+    def __init__(self, bind, tables: list, interval: float):
+        self.bind = bind
+        self.tables = tables
+        self.interval = interval
+        self._counts = {}
+        self._counted_at = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        with self._lock:
+            if self._counted_at is not None and time.monotonic() - self._counted_at < self.interval:
+                return
+            with self.bind.connect() as connection:
+                self._counts = {
+                    table.name: connection.execute(select(func.count()).select_from(table)).scalar()
+                    for table in self.tables
+                }
+            self._counted_at = time.monotonic()
+
+    def collect(self):
+        self._refresh()
+        rows = GaugeMetricFamily("db_table_rows", "Rows per table", labels=["table"])
+        for name, count in self._counts.items():
+            rows.add_metric([name], count)
+        yield rows
+
+
+_pool_state = PoolStateCollector()
+registry.register(_pool_state)
+
+
+def register_table_row_counts(bind, tables: list):
+    registry.register(TableRowCounts(bind, tables, METRICS_ROW_COUNT_INTERVAL_SECONDS))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware, so streaming responses are measured up to their last chunk. Also adds the
+    Server-Timing header and reports repeated statements of each request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        status = 500
+        size = 0
+        in_progress = IN_PROGRESS.labels(method)
+        in_progress.inc()
+        started = time.perf_counter()
+
+        async def send_measured(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                add_server_timing(message, queries)
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            with track_queries() as queries:
+                await self.app(scope, receive, send_measured)
+        finally:
+            elapsed = time.perf_counter() - started
+            in_progress.dec()
+            # The router stores the matched route in the scope; the template keeps the label set bounded
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            REQUESTS.labels(method, route, status).inc()
+            REQUEST_DURATION.labels(method, route).observe(elapsed)
+            RESPONSE_SIZE.labels(method, route).observe(size)
+            REQUEST_QUERIES.labels(method, route).observe(queries.count)
+            warn_repeated(queries, f"{method} {route}")
@@ -0,0 +1,110 @@
+import base64
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class PageParams:
+    # Shared query parameters of every paginated list endpoint
+    def __init__(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    ):
+        self.cursor = cursor
+        self.limit = limit
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps(values, default=lambda value: value.isoformat(), separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+    return values
+
+
+def _coerce(column, value):
+    # Cursor values travel as JSON, each one has to match the type of its key column; a value of another type
+    # would still compare (e.g. a string against an integer key in SQLite) and silently return an empty page
+    invalid = HTTPException(status_code=400, detail="Invalid pagination cursor")
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        python_type = None
+    if value is None or isinstance(value, (bool, list, dict)):
+        raise invalid
+    try:
+        if python_type is datetime:
+            if not isinstance(value, str):
+                raise invalid
+            return datetime.fromisoformat(value)
+        if python_type is float and isinstance(value, (int, float)):
+            return float(value)
+        if python_type is not None and issubclass(python_type, Enum):
+            return python_type(value)
+        if python_type is not None and not isinstance(value, python_type):
+            raise invalid
+    except (TypeError, ValueError):
+        raise invalid
+    return value
+
+
+def _page_statement(query, key_columns: list, page: PageParams, descending: bool):
+    # Works on ORM queries and on select() statements alike
+    if page.cursor:
+        values = decode_cursor(page.cursor)
+        if len(values) != len(key_columns):
+            raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+        values = [_coerce(column, value) for column, value in zip(key_columns, values)]
+        key, after = (key_columns[0], values[0]) if len(key_columns) == 1 else (tuple_(*key_columns), tuple_(*values))
+        query = query.filter(key < after if descending else key > after)
+
+    order_by = [column.desc() for column in key_columns] if descending else key_columns
+    # One extra row tells whether there is a next page without running a COUNT
+    return query.order_by(*order_by).limit(page.limit + 1)
+
+
+def _cut_page(rows: list, key_columns: list, page: PageParams, response: Optional[Response]):
+    next_cursor = None
+    if len(rows) > page.limit:
+        rows = rows[:page.limit]
+        next_cursor = encode_cursor([getattr(rows[-1], column.key) for column in key_columns])
+
+    if response is not None and next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return rows, next_cursor
+
+
+def paginate(query, key_columns: list, page: PageParams, response: Optional[Response] = None, descending: bool = False):
+    """
+    Return one page of `query` ordered by `key_columns` (the last one must be unique, usually the PK)
+    together with an opaque cursor for the next page, or None when this is the last one.
+    With `descending` every key column is walked from the largest value down.
+    """
+    rows = _page_statement(query, key_columns, page, descending).all()
+    return _cut_page(rows, key_columns, page, response)
+
+
+async def paginate_async(db: AsyncSession, statement, key_columns: list, page: PageParams,
+                         response: Optional[Response] = None, descending: bool = False, scalars: bool = True):
+    """paginate() for a select() on an AsyncSession, of one entity or with `scalars=False` of plain columns."""
+    result = await db.execute(_page_statement(statement, key_columns, page, descending))
+    rows = result.scalars().all() if scalars else result.all()
+    return _cut_page(list(rows), key_columns, page, response)
@@ -0,0 +1,88 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from backend.logging_config import logger
+
+load_dotenv()
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+# Hashes allowed to wait for a worker; past that requests get a 503 instead of piling up behind a login storm
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", PASSWORD_HASH_WORKERS * 8))
+
+_pool = None
+_pool_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def _hashpw(password: bytes, rounds: int) -> bytes:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _checkpw(password: bytes, hashed: bytes) -> bool:
+    return bcrypt.checkpw(password, hashed)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the server process already runs threads that a forked child would inherit broken
+            _pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            logger.info(f"Password hashing pool started with {PASSWORD_HASH_WORKERS} workers, bcrypt cost {BCRYPT_ROUNDS}")
+        return _pool
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+async def _run_in_pool(func, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_MAX_PENDING:
+            logger.warning(f"Password hashing queue is full ({_pending} pending), rejecting request")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), func, *args)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+
+
+async def hash_password(password: str) -> str:
+    hashed = await _run_in_pool(_hashpw, password.encode('utf-8'), BCRYPT_ROUNDS)
+    return hashed.decode('utf-8')
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run_in_pool(_checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def hash_password_sync(password: str) -> str:
+    # For startup and seeding code that runs outside of a request
+    return _hashpw(password.encode('utf-8'), BCRYPT_ROUNDS).decode('utf-8')
+
+
+def needs_rehash(hashed: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    try:
+        return int(hashed.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
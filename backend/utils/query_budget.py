@@ -0,0 +1,123 @@
+"""
+Check that the details endpoints stay within their query budget.
+
+    python -m backend.utils.query_budget
+
+Every budgeted route is called twice as an admin. The first call warms the principal cache, so only the
+statements of the second one are counted. Exits with 1 when an endpoint runs more statements than allowed.
+Batch details endpoints are called with the first BATCH_SAMPLE_SIZE ids of their table and must stay
+within the same budget whatever the number of ids.
+
+Tests can hold a route to a budget with `assert_max_queries`:
+
+    with TestClient(app) as client:
+        assert_max_queries(client, "/api/ships/1/details", 1, headers=headers)
+"""
+import sys
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from backend.database import engine, engines
+
+# Statements each details endpoint may run, whatever the number of related rows: to-one relations and one
+# collection are joined, further collections are loaded with one statement each
+DETAILS_QUERY_BUDGETS = {
+    "/api/orders/{order_id}": 2,
+    "/api/ports/{id_port}/details": 4,
+    "/api/ships/{id_ship}/details": 1,
+    "/api/products/{id_product}/details": 1,
+    "/api/clients/{id_client}/details": 1,
+    "/api/operations/{id_operation}/details": 1,
+}
+
+BATCH_QUERY_BUDGETS = {
+    "/api/orders/details": ("order", 2),
+    "/api/ports/details": ("port", 4),
+    "/api/ships/details": ("ship", 1),
+    "/api/products/details": ("product", 1),
+}
+BATCH_SAMPLE_SIZE = 100
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+
+@contextmanager
+def count_queries(*binds):
+    """Collect every statement sent to the database inside the block, by all the app's engines by default."""
+    binds = binds or tuple(getattr(bind, "sync_engine", bind) for bind in engines)
+    counter = QueryCounter()
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        counter.statements.append(statement)
+
+    for bind in binds:
+        event.listen(bind, "before_cursor_execute", record)
+    try:
+        yield counter
+    finally:
+        for bind in binds:
+            event.remove(bind, "before_cursor_execute", record)
+
+
+def format_statements(statements) -> str:
+    return "\n".join(f"    {' '.join(statement.split())}" for statement in statements)
+
+
+def assert_max_queries(client, url: str, max_queries: int, method: str = "GET", **kwargs):
+    """
+    Call `url` through `client` (a TestClient of the app) and fail the test when it runs more than
+    `max_queries` statements. Keyword arguments go to the request; returns the response.
+    """
+    with count_queries() as counter:
+        response = client.request(method, url, **kwargs)
+    assert counter.count <= max_queries, (
+        f"{method} {url} ran {counter.count} statements, more than {max_queries}:\n"
+        f"{format_statements(counter.statements)}"
+    )
+    return response
+
+
+def main() -> int:
+    from backend.main import app
+    from backend.utils.explain_queries import PATH_ID_COLUMNS, admin_headers, fill_path, sample_ids
+
+    with Session(engine) as session:
+        ids = sample_ids(session)
+        headers = admin_headers(session)
+        batch_ids = {
+            name: ",".join(str(id_) for (id_,) in session.query(PATH_ID_COLUMNS[name]).limit(BATCH_SAMPLE_SIZE))
+            for name, _ in BATCH_QUERY_BUDGETS.values()
+        }
+    if headers is None:
+        print("No admin client in the database, start the server once to create the default users")
+        return 1
+
+    over_budget = 0
+    urls = [(path, fill_path(path, ids), budget) for path, budget in DETAILS_QUERY_BUDGETS.items()]
+    urls += [(path, f"{path}?ids={batch_ids[name]}", budget) for path, (name, budget) in BATCH_QUERY_BUDGETS.items()]
+    # Entering the client runs the app lifespan, whose shutdown closes the async engine's connections
+    with TestClient(app) as client:
+        for path, url, budget in urls:
+            client.get(url, headers=headers)
+            with count_queries() as counter:
+                response = client.get(url, headers=headers)
+            status = "ok" if counter.count <= budget else "OVER BUDGET"
+            print(f"GET {path}: {counter.count}/{budget} statements, HTTP {response.status_code} {status}")
+            if counter.count > budget:
+                over_budget += 1
+                print(format_statements(counter.statements))
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+SQL statements of the request being served: how many, how long they took and which ones repeat. The totals
+are sent in the Server-Timing header, and a SELECT run N_PLUS_ONE_THRESHOLD times or more with only its
+parameters changing is logged as a likely N+1 (one lazy load or refresh per row instead of one query).
+"""
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from backend.logging_config import logger
+
+load_dotenv()
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "true").lower() in ("1", "true", "yes")
+# 0 turns the N+1 warning off
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+# Expanded IN lists have one placeholder per value, they are folded so their length does not change the shape
+_IN_LIST = re.compile(r"\bIN\s*\(\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|\$\d+|:\w+))*\s*\)")
+
+
+def statement_shape(statement: str) -> str:
+    return _IN_LIST.sub("IN (?)", " ".join(statement.split()))
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list:
+        """(shape, times) of the statements run at least `threshold` times, most repeated first."""
+        if threshold <= 0:
+            return []
+        return [(shape, times) for shape, times in self.shapes.most_common() if times >= threshold]
+
+    def server_timing(self) -> str:
+        return f'db;dur={self.duration * 1000:.1f};desc="{self.count} {"query" if self.count == 1 else "queries"}"'
+
+
+# Stats of the request being served, shared with the threadpool the sync routes run on
+_current: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _current.get()
+
+
+def warn_repeated(stats: QueryStats, label: str):
+    for shape, times in stats.repeated():
+        logger.warning(f"Possible N+1 in {label}: statement ran {times} times: {shape}")
+
+
+@contextmanager
+def track_queries(label: Optional[str] = None):
+    """
+    Collect the statements of the block, e.g. a request or a startup job. With a `label` the repeated ones
+    are logged on exit; without one the caller reports them, once it knows what to call the block.
+    """
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        if label is not None:
+            warn_repeated(stats, label)
+
+
+def track_engine(bind):
+    """Record the statements `bind` (sync or async engine) runs inside track_queries."""
+    sync_bind = getattr(bind, "sync_engine", bind)
+
+    @event.listens_for(sync_bind, "before_cursor_execute")
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        if context is not None and _current.get() is not None:
+            context.query_started = time.perf_counter()
+
+    @event.listens_for(sync_bind, "after_cursor_execute")
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        stats = _current.get()
+        started = getattr(context, "query_started", None)
+        if stats is None or started is None:
+            return
+        stats.count += 1
+        stats.duration += time.perf_counter() - started
+        # Writes repeat legitimately (one INSERT per new row), only reads are checked for N+1
+        if statement.lstrip()[:6].upper() == "SELECT":
+            stats.shapes[statement_shape(statement)] += 1
+
+
+def add_server_timing(message: dict, stats: QueryStats):
+    # Added to the response start, statements a streaming body runs afterwards are not included
+    if SERVER_TIMING_ENABLED:
+        message["headers"] = [*message.get("headers", []), (b"server-timing", stats.server_timing().encode())]
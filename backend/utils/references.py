@@ -0,0 +1,87 @@
+import os
+from collections import defaultdict
+from typing import Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.orm import Session
+
+from backend.logging_config import logger
+from backend.models import Port, Ship
+from backend.utils.cache import TTLCache
+
+load_dotenv()
+# Existence of ports and ships is remembered this long; they are rarely created and almost never deleted
+REFERENCE_CACHE_TTL_SECONDS = float(os.getenv("REFERENCE_CACHE_TTL_SECONDS", 30))
+REFERENCE_CACHE_MAX_ENTRIES = int(os.getenv("REFERENCE_CACHE_MAX_ENTRIES", 100000))
+# Ids per statement, below SQLite's bound parameter limit
+REFERENCE_LOOKUP_CHUNK = 500
+
+
+def _table(column) -> str:
+    return column.class_.__tablename__
+
+
+class ReferenceValidator:
+    """
+    Checks that the ids a write refers to exist, for every referenced table at once: one IN list per table,
+    glued into a single UNION ALL statement. Ids of the `cached` columns that were found recently are served
+    from a short TTL cache. Only existing ids are cached, a missing one is always looked up again.
+    """
+
+    def __init__(self, cached: Iterable = (), ttl: float = REFERENCE_CACHE_TTL_SECONDS,
+                 max_entries: int = REFERENCE_CACHE_MAX_ENTRIES):
+        self._cached_tables = {_table(column) for column in cached}
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def find_missing(self, db: Session, references: List[Tuple[object, Iterable[Optional[int]]]]) -> List[set]:
+        """For each (column, ids) pair the ids that do not exist, in the same order. None ids are ignored."""
+        wanted = []
+        for column, ids in references:
+            ids = {id_ for id_ in ids if id_ is not None}
+            if _table(column) in self._cached_tables:
+                ids = {id_ for id_ in ids if self.cache.get((_table(column), id_)) is None}
+            wanted.append(sorted(ids))
+
+        found = defaultdict(set)
+        branches, size = [], 0
+        for index, (column, ids) in enumerate(zip((column for column, _ in references), wanted)):
+            for start in range(0, len(ids), REFERENCE_LOOKUP_CHUNK):
+                chunk = ids[start:start + REFERENCE_LOOKUP_CHUNK]
+                branches.append(select(literal(index).label("reference"), column.label("id")).where(column.in_(chunk)))
+                size += len(chunk)
+                if size >= REFERENCE_LOOKUP_CHUNK:
+                    self._lookup(db, branches, found)
+                    branches, size = [], 0
+        if branches:
+            self._lookup(db, branches, found)
+
+        missing = []
+        for index, ((column, _), ids) in enumerate(zip(references, wanted)):
+            if _table(column) in self._cached_tables:
+                for id_ in found[index]:
+                    self.cache.set((_table(column), id_), True)
+            missing.append(set(ids) - found[index])
+        return missing
+
+    @staticmethod
+    def _lookup(db: Session, branches: list, found: defaultdict):
+        statement = branches[0] if len(branches) == 1 else union_all(*branches)
+        for reference, id_ in db.execute(statement):
+            found[reference].add(id_)
+
+    def require(self, db: Session, *references: Tuple[object, Optional[int]]):
+        """Raise a 404 naming every (column, id) reference of a single write that does not exist."""
+        missing = self.find_missing(db, [(column, [id_]) for column, id_ in references])
+        not_found = [(column.class_.__name__, id_) for (column, id_), ids in zip(references, missing) if ids]
+        if not_found:
+            logger.error(f"Referenced rows not found: {', '.join(f'{name} {id_}' for name, id_ in not_found)}")
+            raise HTTPException(status_code=404, detail=", ".join(f"{name} not found" for name, _ in not_found))
+
+    def forget(self, column, id_: int):
+        # Called when a cached row is deleted
+        self.cache.pop((_table(column), id_))
+
+
+reference_validator = ReferenceValidator(cached=[Port.id_port, Ship.id_ship])
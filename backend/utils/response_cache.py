@@ -0,0 +1,120 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Optional
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from backend.database import READ_DATABASE_URL, READ_YOUR_WRITES_SECONDS, SQLALCHEMY_DATABASE_URL, reads_from_primary
+from backend.utils.cache import TTLCache
+from backend.utils.pagination import NEXT_CURSOR_HEADER
+
+load_dotenv()
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+# Writes invalidate their scope straight away, the TTL only bounds staleness across workers
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 300))
+# The cache is bounded by entries, larger bodies are served but not kept so a few pages cannot fill the memory
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+
+
+class CachedResponse:
+    def __init__(self, body: bytes, etag: str, next_cursor: Optional[str]):
+        self.body = body
+        self.etag = etag
+        self.next_cursor = next_cursor
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and (
+        if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+    )
+
+
+class ResponseCache:
+    """
+    Serialized JSON responses of list endpoints, keyed by scope (e.g. "ships"), path and query string,
+    each with a strong ETag so unchanged pages are answered with 304. Writes drop their whole scope.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, max_entry_bytes: int, replica_lag: float = 0):
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.max_entry_bytes = max_entry_bytes
+        # For this long after a write the replica may not show it yet, pages read from it are not stored
+        self.replica_lag = replica_lag
+        self._generations = {}  # scope -> number of invalidations so far
+        self._invalidated_at = {}  # scope -> time.monotonic() of the last invalidation
+        self._lock = threading.Lock()
+        self._adapters = {}
+
+    @staticmethod
+    def _key(scope: str, request: Request) -> tuple:
+        return scope, request.url.path, tuple(sorted(request.query_params.multi_items()))
+
+    def _response(self, request: Request, entry: CachedResponse) -> Response:
+        headers = {"ETag": entry.etag}
+        if entry.next_cursor:
+            headers[NEXT_CURSOR_HEADER] = entry.next_cursor
+        if etag_matches(request, entry.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=entry.body, media_type="application/json", headers=headers)
+
+    def lookup(self, scope: str, request: Request, cacheable: bool = True) -> Optional[Response]:
+        """
+        The cached response for `request`, or None, in which case the route builds it and calls store().
+        Responses that are not `cacheable` (e.g. with embedded images) are always built.
+        """
+        # A client that has just written reads the primary, the shared pages may predate its write
+        if not cacheable or reads_from_primary(request):
+            return None
+        entry = self.cache.get(self._key(scope, request))
+        if entry is not None:
+            return self._response(request, entry)
+        # A store() for a page read before a concurrent write must not outlive that write's invalidation
+        with self._lock:
+            request.state.response_cache_generation = self._generations.get(scope, 0)
+        return None
+
+    def store(self, scope: str, request: Request, response_model: Any, content: Any,
+              response: Optional[Response] = None, cacheable: bool = True) -> Response:
+        """Serialize `content` as `response_model`, cache it if it is `cacheable` and answer `request` with it."""
+        adapter = self._adapters.get(response_model)
+        if adapter is None:
+            adapter = self._adapters[response_model] = TypeAdapter(response_model)
+        body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+        entry = CachedResponse(
+            body,
+            f'"{hashlib.sha256(body).hexdigest()[:32]}"',
+            response.headers.get(NEXT_CURSOR_HEADER) if response is not None else None,
+        )
+        if not cacheable or len(body) > self.max_entry_bytes or reads_from_primary(request):
+            return self._response(request, entry)
+        with self._lock:
+            lagging = time.monotonic() - self._invalidated_at.get(scope, float("-inf")) < self.replica_lag
+            current = getattr(request.state, "response_cache_generation", None) == self._generations.get(scope, 0)
+            if current and not lagging:
+                self.cache.set(self._key(scope, request), entry)
+        return self._response(request, entry)
+
+    def invalidate(self, *scopes: str):
+        with self._lock:
+            for scope in scopes:
+                self._generations[scope] = self._generations.get(scope, 0) + 1
+                self._invalidated_at[scope] = time.monotonic()
+        return self.cache.pop_where(lambda key, _: key[0] in scopes)
+
+    def stats(self) -> dict:
+        return self.cache.stats()
+
+
+# Catalog lists polled by the frontend: ships, ports and products
+catalog_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=RESPONSE_CACHE_TTL_SECONDS,
+    max_entry_bytes=RESPONSE_CACHE_MAX_ENTRY_BYTES,
+    # Without a separate replica the reads see every commit straight away
+    replica_lag=READ_YOUR_WRITES_SECONDS if READ_DATABASE_URL != SQLALCHEMY_DATABASE_URL else 0,
+)
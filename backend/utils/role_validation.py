@@ -1,7 +1,20 @@
+from dataclasses import dataclass
 from fastapi import HTTPException, status
 from backend.models.client import Client, UserRole
 
-def check_user_role(current_client: Client, required_roles: list[UserRole]):
+
+@dataclass(frozen=True)
+class Principal:
+    # What authenticated routes know about the caller, cached per token so no query is needed
+    id_client: int
+    role: UserRole
+
+    @classmethod
+    def from_client(cls, client: Client):
+        return cls(id_client=client.id_client, role=client.role)
+
+
+def check_user_role(current_client: Principal, required_roles: list[UserRole]):
     if current_client.role not in required_roles:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -0,0 +1,35 @@
+"""
+Fast path for large JSON responses. Instead of loading ORM objects and letting FastAPI validate them one by
+one through the response_model, routes select the model's fields as plain columns, turn the rows into dicts
+and render them with orjson. orjson writes datetimes in ISO 8601 and enums by their value, so the payload is
+the same as the one the response_model would produce.
+"""
+from typing import Optional
+
+from fastapi import Response
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+
+def model_columns(model: type[BaseModel], entity, **expressions) -> list:
+    """
+    One column per field of `model`, labeled with the field name: the expression given for it in
+    `expressions`, otherwise the attribute of `entity` with the same name.
+    """
+    return [(expressions[name] if name in expressions else getattr(entity, name)).label(name)
+            for name in model.model_fields]
+
+
+def row_dicts(rows) -> list:
+    if not rows:
+        return []
+    keys = rows[0]._fields
+    return [dict(zip(keys, row)) for row in rows]
+
+
+def json_response(content, response: Optional[Response] = None) -> ORJSONResponse:
+    """
+    Render `content` (dicts, lists, datetimes, enums) with orjson. Returning a response bypasses the injected
+    `response`, so the headers the route set on it (next cursor, ETag) are carried over.
+    """
+    return ORJSONResponse(content, headers=dict(response.headers) if response is not None else None)
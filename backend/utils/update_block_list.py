@@ -1,35 +1,118 @@
+import asyncio
+import os
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
 import httpx
+from dotenv import load_dotenv
+from sqlalchemy import delete, insert
 from sqlalchemy.orm import Session
 from backend.database import engine
+from backend.logging_config import logger
 from backend.models.debl.email_block_list import email_block_list
+from backend.utils.domain_blocklist import domain_blocklist
 
-# URL for the disposable email blocklist
-BLOCKLIST_URL = "https://raw.githubusercontent.com/disposable-email-domains/disposable-email-domains/master/disposable_email_blocklist.conf"
+load_dotenv()
+# URL for the disposable email blocklist, a file:// URL or a plain path works too (e.g. for tests)
+BLOCKLIST_URL = os.getenv(
+    "BLOCKLIST_URL",
+    "https://raw.githubusercontent.com/disposable-email-domains/disposable-email-domains/master/disposable_email_blocklist.conf",
+)
+BLOCKLIST_REFRESH_INTERVAL_SECONDS = float(os.getenv("BLOCKLIST_REFRESH_INTERVAL_SECONDS", 24 * 60 * 60))
+CHUNK_SIZE = 500  # stays below SQLite's bound parameter limit for the IN lists of deletes
 
-def fetch_blocklist():
-    try:
-        response = httpx.get(BLOCKLIST_URL, timeout=10.0)
+# Validators of the last successful fetch, sent back so an unchanged list costs a 304 and no parsing
+_validators = {}
+
+
+def _parse_lines(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        domain = line.strip().lower()
+        if domain and not domain.startswith('#'):
+            yield domain
+
+
+def _fetch_local(path: Path) -> Optional[set]:
+    mtime = path.stat().st_mtime
+    if _validators.get("mtime") == mtime:
+        return None
+    with open(path, encoding="utf-8") as blocklist_file:
+        domains = set(_parse_lines(blocklist_file))
+    _validators.clear()
+    _validators["mtime"] = mtime
+    return domains
+
+
+def fetch_blocklist(url: str = BLOCKLIST_URL) -> Optional[set]:
+    """
+    Return the set of blocked domains, or None when the source has not changed since the last fetch.
+    The response is parsed line by line as it streams in.
+    """
+    if url.startswith("file://") or "://" not in url:
+        return _fetch_local(Path(url[len("file://"):] if url.startswith("file://") else url))
+
+    headers = {}
+    if "etag" in _validators:
+        headers["If-None-Match"] = _validators["etag"]
+    if "last-modified" in _validators:
+        headers["If-Modified-Since"] = _validators["last-modified"]
+
+    with httpx.stream("GET", url, headers=headers, timeout=10.0, follow_redirects=True) as response:
+        if response.status_code == 304:
+            return None
         response.raise_for_status()
-        return response.text.splitlines()
-    except httpx.RequestError as e:
-        print(f"Error fetching blocklist: {e}")
-        return []
+        domains = set(_parse_lines(response.iter_lines()))
+        _validators.clear()
+        for header in ("etag", "last-modified"):
+            if header in response.headers:
+                _validators[header] = response.headers[header]
+    return domains
+
 
-def update_blocklist():
-    blocklist = fetch_blocklist()
+def _chunks(items: list) -> Iterator[list]:
+    for start in range(0, len(items), CHUNK_SIZE):
+        yield items[start:start + CHUNK_SIZE]
+
+
+def update_blocklist(url: str = BLOCKLIST_URL):
+    try:
+        blocklist = fetch_blocklist(url)
+    except (httpx.HTTPError, OSError) as e:
+        logger.error(f"Error fetching blocklist: {e}")
+        return
+    if blocklist is None:
+        logger.info("Blocklist not modified since the last refresh")
+        return
     if not blocklist:
-        print("No blocklist data available")
+        # An empty download is far more likely a broken source than a list that was emptied on purpose
+        logger.warning("No blocklist data available")
         return
 
     with Session(engine) as session:
-        session.query(email_block_list).delete()
-
-        for domain in blocklist:
-            if domain.strip():  # Check if it's not empty
-                session.add(email_block_list(domain=domain.strip()))
+        current = {domain for (domain,) in session.query(email_block_list.domain)}
+        to_add = sorted(blocklist - current)
+        to_remove = sorted(current - blocklist)
 
+        for chunk in _chunks(to_remove):
+            session.execute(delete(email_block_list).where(email_block_list.domain.in_(chunk)))
+        for chunk in _chunks(to_add):
+            session.execute(insert(email_block_list), [{"domain": domain} for domain in chunk])
         session.commit()
-        print(f"Blocklist updated with {len(blocklist)} domains.")
+    logger.info(f"Blocklist refreshed: {len(blocklist)} domains, {len(to_add)} added, {len(to_remove)} removed")
+
+    # Registration reads the in-memory copy, swap it for the new version right away. Also when the table was
+    # already up to date: another worker or the CLI may have written it while this process kept an older copy.
+    domain_blocklist.load(blocklist)
+
+
+async def refresh_blocklist_periodically(interval: float = BLOCKLIST_REFRESH_INTERVAL_SECONDS):
+    while True:
+        try:
+            await asyncio.to_thread(update_blocklist)
+        except Exception as e:
+            logger.error(f"Blocklist refresh failed: {e}")
+        await asyncio.sleep(interval)
+
 
 if __name__ == "__main__":
     update_blocklist()
@@ -75,7 +75,7 @@ const PortDetails = () => {
             </Row>
 
             {/* Operations Section */}
-            <h4 className="section-name">Operations</h4>
+            <h4 className="section-name">Operations ({port.operations_count})</h4>
             <div className="section-divider mb-3"></div>
             {port.operations.length > 0 ? (
                 <Table striped bordered hover className="shadow-sm">
@@ -107,7 +107,7 @@ const PortDetails = () => {
             )}
 
             {/* Orders Section */}
-            <h4 className="section-name">Orders</h4>
+            <h4 className="section-name">Orders ({port.orders_count})</h4>
             <div className="section-divider mb-3"></div>
             {port.orders.length > 0 ? (
                 <Table striped bordered hover className="shadow-sm">
@@ -137,7 +137,7 @@ const PortDetails = () => {
             )}
 
             {/* Products Section */}
-            <h4 className="section-name">Products</h4>
+            <h4 className="section-name">Products ({port.products_count})</h4>
             <div className="section-divider mb-3"></div>
             {port.products.length > 0 ? (
                 <Table striped bordered hover className="shadow-sm">
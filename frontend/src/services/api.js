@@ -25,7 +25,7 @@ export const fetchShipDetails = async (ship_id) => {
 }
 export const fetchShips = async () => {
     await verifyRoles(['EMPLOYEE', 'ADMIN']);
-    return await fetchProtectedData(`/api/ships/`);
+    return await fetchAllPages(`/api/ships`);
 };
 
 export const createShip = async (ship) => {
@@ -76,8 +76,8 @@ export const updateShip = async (ship) => {
     }
 };
 
-export const fetchShipImage = async (id_ship) => {
-    const response = await fetch(`${API_URL}/api/ships/image/${id_ship}`);
+export const fetchShipImage = async (id_ship, size = 'card') => {
+    const response = await fetch(`${API_URL}/api/ships/image/${id_ship}?size=${size}`);
     if (!response.ok) {
       throw new Error('Failed to fetch ship image');
     }
@@ -119,7 +119,7 @@ export async function fetchOperationDetails(id_operation) {
 
 export const fetchOperations = async () => {
   await verifyRoles(['EMPLOYEE', 'ADMIN']);
-  return await fetchProtectedData(`/api/operations/`);
+  return await fetchAllPages(`/api/operations`);
 };
 
 export const createOperation = async (operation) => {
@@ -234,7 +234,7 @@ export const fetchPortDetails = async (id_port) => {
 
 export async function fetchProductsByPort(portId) {
   await verifyRoles(['EMPLOYEE', 'ADMIN', 'CLIENT']);
-  return await fetchProtectedData(`/api/products/port/${portId}`);
+  return await fetchAllPages(`/api/products/port/${portId}`);
 }
 
 // Guest Table product do not add auth
@@ -245,11 +245,12 @@ export const fetchProductDetails = async (id_product) => {
 };
 
 export const fetchProducts = async () => {
-  const response = await fetch(`${API_URL}/api/products`);
-  if (!response.ok) {
+  try {
+    // Public endpoint, no token
+    return await fetchAllPages(`/api/products`, (endpoint, options) => axios(`${API_URL}${endpoint}`, options));
+  } catch (error) {
     throw new Error('Failed to fetch products');
   }
-  return response.json();
 };
 
 export const createProduct = async (product) => {
@@ -300,8 +301,8 @@ export const updateProduct = async (product) => {
     }
 };
 
-export const fetchProductImage = async (id_product) => {
-  const response = await fetch(`${API_URL}/api/products/image/${id_product}`);
+export const fetchProductImage = async (id_product, size = 'card') => {
+  const response = await fetch(`${API_URL}/api/products/image/${id_product}?size=${size}`);
   if (!response.ok) {
     throw new Error('Failed to fetch product image');
   }
@@ -336,7 +337,7 @@ export const fetchOrders = async () => {
         }
 
         await verifyRoles(['EMPLOYEE', 'ADMIN']);
-        return await fetchProtectedData(`/api/orders`);
+        return await fetchAllPages(`/api/orders`);
     } catch (error) {
         console.error("Error fetching orders:", error.message);
         throw error;
@@ -356,18 +357,18 @@ export const fetchOrderDetails = async (order_id) => {
 
 export const fetchOrdersByPort = async (port_id) => {
     await verifyRoles(['EMPLOYEE', 'ADMIN', 'CLIENT']);
-    return await fetchProtectedData(`/api/orders/port/${port_id}`);
+    return await fetchAllPages(`/api/orders/port/${port_id}`);
 }
 
 
 export const fetchOrdersByClient = async (client_id) => {
     await verifyRoles(['CLIENT', 'EMPLOYEE', 'ADMIN']);
-    return await fetchProtectedData(`/api/orders/client/${client_id}`);
+    return await fetchAllPages(`/api/orders/client/${client_id}`);
 }
 
 export const fetchOrdersForOwner = async (client_id) => {
     await verifyRoles(['CLIENT']);
-    return await fetchProtectedData(`/api/orders/client/${client_id}`);
+    return await fetchAllPages(`/api/orders/client/${client_id}`);
 }
 
 
@@ -423,7 +424,7 @@ export const updateOrder = async (order) => {
 
 export const fetchOrders_products = async () => {
     await verifyRoles(['EMPLOYEE', 'ADMIN']);
-    return await fetchProtectedData(`/api/orders_products`);
+    return await fetchAllPages(`/api/orders_products`);
 };
 
 export const fetchOrders_productsByOrder = async (order_id) => {
@@ -558,11 +559,11 @@ export const fetchExcludedProducts = async () => {
   await verifyRoles(['CLIENT','EMPLOYEE','ADMIN'])
   try {
     console.log("Making GET request to /api/products/exclude");
-    const response = await axios.get(`${API_URL}/api/products/exclude`, {
-      headers: authHeaders(),
-    });
-    console.log("Response from /api/products/exclude:", response.data);
-    return response.data;
+    const products = await fetchAllPages(`/api/products/exclude`, (endpoint, options) =>
+      axios.get(`${API_URL}${endpoint}`, { ...options, headers: authHeaders() })
+    );
+    console.log("Response from /api/products/exclude:", products);
+    return products;
   } catch (error) {
     console.error("Error in fetchExcludedProducts:", error.response?.data || error.message);
     throw error.response?.data || new Error("Failed to fetch excluded products");
@@ -577,7 +578,7 @@ export const fetchClientDetails = async (clientId) => {
 export const fetchClients = async () => {
     try {
         await verifyRoles(['CLIENT', 'EMPLOYEE' ,'ADMIN']);
-        return await fetchProtectedData(`/api/clients`);
+        return await fetchAllPages(`/api/clients`);
     } catch (error) {
         console.error("Role verification failed:", error.message);
         throw error;
@@ -715,7 +716,7 @@ export const verifyRoles = async (requiredRoles) => {
   }
 };
 
-const fetchProtectedData = async (endpoint, options = {}) => {
+const fetchProtectedResponse = async (endpoint, options = {}) => {
   const token = localStorage.getItem('token'); // Token retrieval logic
   if (!token) {
     console.error("Authentication token not found in localStorage");
@@ -723,7 +724,7 @@ const fetchProtectedData = async (endpoint, options = {}) => {
   }
 
   try {
-    const response = await axios(`${API_URL}${endpoint}`, {
+    return await axios(`${API_URL}${endpoint}`, {
       ...options,
       headers: {
         Authorization: `Bearer ${token}`,
@@ -731,8 +732,6 @@ const fetchProtectedData = async (endpoint, options = {}) => {
         ...options.headers,
       },
     });
-
-    return response.data; // Return parsed JSON data
   } catch (error) {
     // Enhanced error handling
     if (error.response) {
@@ -758,6 +757,27 @@ const fetchProtectedData = async (endpoint, options = {}) => {
   }
 };
 
+const fetchProtectedData = async (endpoint, options = {}) => {
+  const response = await fetchProtectedResponse(endpoint, options);
+  return response.data; // Return parsed JSON data
+};
+
+// List endpoints return one page at a time and announce the next one in the X-Next-Cursor header,
+// the whole list is collected here so lists and dropdowns never stop at the first page
+const PAGE_SIZE = 1000; // MAX_PAGE_SIZE of the backend
+
+const fetchAllPages = async (endpoint, fetchPage = fetchProtectedResponse) => {
+  const rows = [];
+  let cursor;
+  do {
+    const params = cursor ? { limit: PAGE_SIZE, cursor } : { limit: PAGE_SIZE };
+    const response = await fetchPage(endpoint, { params });
+    rows.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return rows;
+};
+
 
 
 